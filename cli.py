@@ -0,0 +1,239 @@
+import os
+import glob
+import time
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+import typer
+import sync
+import qbd_cache
+import reconcile as reconciler
+import plan as planner
+import replay as replayer
+import dead_letters
+from fingerprints import MAX_BUCKETS, RECONCILE_BUCKETS
+from qbwc import qwclog
+
+# Command-line entry point for the sync engine.
+#
+#   uv run python cli.py sync
+#   uv run python cli.py --concurrency 8 --page-size 100 expenses-only
+#   uv run python cli.py --profile --trace-memory customers-only
+#   uv run python cli.py benchmark --runs 3
+#
+# Global options configure sync.py's module settings before the command
+# runs; --profile and --trace-memory wrap each phase and write reports to
+# REPORT_DIR.
+
+app = typer.Typer(help="QuickBooks-Filevine sync engine", no_args_is_help=True)
+
+REPORT_DIR = "logs"
+
+# Number of rows written to each profiling report
+REPORT_LIMIT = 40
+
+options = {"profile": False, "trace_memory": False}
+
+@app.callback()
+def configure(
+    api: str = typer.Option(sync.FILEVINE_API, help="Filevine API base URL"),
+    end_user: str = typer.Option(sync.END_USER_ID, help="Conductor end-user ID"),
+    concurrency: int = typer.Option(sync.CONCURRENCY, min=1, help="Filevine writes in flight at once"),
+    batch_size: int = typer.Option(sync.QBD_BATCH_SIZE, min=1, help="QuickBooks updates per Conductor batch"),
+    billing_batch_size: int = typer.Option(sync.BILLING_BATCH_SIZE, min=1, max=500, help="Invoices/time entries per Filevine batch"),
+    page_size: Optional[int] = typer.Option(sync.PAGE_SIZE, min=1, max=150, help="Conductor list page size"),
+    item_lines: bool = typer.Option(sync.SYNC_ITEM_LINES, help="Sync ItemLine entries instead of ExpenseLine"),
+    profile: bool = typer.Option(False, "--profile", help="Profile each phase with cProfile"),
+    trace_memory: bool = typer.Option(False, "--trace-memory", help="Trace allocations in each phase with tracemalloc"),
+    refresh_cache: bool = typer.Option(False, "--refresh-cache", help="Re-list cached QuickBooks data instead of reading the cache"),
+):
+    sync.FILEVINE_API = api
+    sync.END_USER_ID = end_user
+    sync.CONCURRENCY = concurrency
+    sync.QBD_BATCH_SIZE = batch_size
+    sync.PAGE_SIZE = page_size
+    sync.BILLING_BATCH_SIZE = billing_batch_size
+    sync.SYNC_ITEM_LINES = item_lines
+    options["profile"] = profile
+    options["trace_memory"] = trace_memory
+    qbd_cache.REFRESH = refresh_cache
+
+def report_path(phase, kind):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    return os.path.join(REPORT_DIR, f"{kind}_{phase}_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+
+def write_profile(phase, profiler):
+    path = report_path(phase, "profile")
+    profiler.dump_stats(path.replace(".txt", ".prof"))
+    with open(path, "w") as f:
+        for sort_key in ("cumulative", "tottime"):
+            f.write(f"=== {phase}: top {REPORT_LIMIT} by {sort_key} ===\n")
+            pstats.Stats(profiler, stream=f).strip_dirs().sort_stats(sort_key).print_stats(REPORT_LIMIT)
+    print(f"Profile for {phase} written to {path}")
+
+def write_memory_report(phase, snapshot, peak):
+    path = report_path(phase, "memory")
+    with open(path, "w") as f:
+        f.write(f"=== {phase}: peak traced memory {peak / 1024:.1f} KiB ===\n")
+        f.write(f"=== top {REPORT_LIMIT} allocation sites by size ===\n")
+        for stat in snapshot.statistics("lineno")[:REPORT_LIMIT]:
+            f.write(f"{stat}\n")
+        f.write(f"\n=== top {REPORT_LIMIT} allocation tracebacks ===\n")
+        for stat in snapshot.statistics("traceback")[:REPORT_LIMIT]:
+            f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            for line in stat.traceback.format():
+                f.write(f"  {line}\n")
+    print(f"Memory report for {phase} written to {path}")
+
+# Wrap a phase in cProfile and/or tracemalloc according to the global options
+@contextmanager
+def instrumented(phase):
+    profiler = cProfile.Profile() if options["profile"] else None
+    if options["trace_memory"]:
+        tracemalloc.start(25)
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            write_profile(phase, profiler)
+        if options["trace_memory"]:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            write_memory_report(phase, snapshot, peak)
+
+def instrument(fn):
+    def phase():
+        with instrumented(fn.__name__):
+            fn()
+    phase.__name__ = fn.__name__
+    return phase
+
+def run(phases, dry_run=False):
+    sync.DRY_RUN = dry_run
+    sync.sync(tuple(instrument(phase) for phase in phases))
+
+@app.command("sync")
+def sync_all(dry_run: bool = typer.Option(False, "--dry-run", help="Print writes instead of sending them")):
+    """Sync contacts (both directions), expenses, invoices and time entries."""
+    run(sync.SYNC_PHASES, dry_run)
+
+@app.command("customers-only")
+def customers_only(dry_run: bool = typer.Option(False, "--dry-run", help="Print writes instead of sending them")):
+    """Sync contacts only."""
+    run((sync.sync_contacts,), dry_run)
+
+@app.command("expenses-only")
+def expenses_only(dry_run: bool = typer.Option(False, "--dry-run", help="Print writes instead of sending them")):
+    """Sync expenses only."""
+    run((sync.sync_expenses,), dry_run)
+
+@app.command("billing-only")
+def billing_only(dry_run: bool = typer.Option(False, "--dry-run", help="Print writes instead of sending them")):
+    """Stream invoices and time entries into Filevine."""
+    run((sync.sync_invoices, sync.sync_time_entries), dry_run)
+
+@app.command("dry-run")
+def dry_run():
+    """Run a full sync without writing to Filevine, QuickBooks or the mappings file."""
+    run(sync.SYNC_PHASES, dry_run=True)
+
+@app.command()
+def benchmark(
+    runs: int = typer.Option(3, min=1, help="Timed runs per phase"),
+    write: bool = typer.Option(False, "--write", help="Send writes instead of benchmarking in dry-run mode"),
+):
+    """Time each sync phase over several runs (dry-run unless --write)."""
+    sync.DRY_RUN = not write
+    sync.load_mappings()
+    timings = {phase.__name__: [] for phase in sync.SYNC_PHASES}
+    for i in range(runs):
+        for phase in sync.SYNC_PHASES:
+            start = time.perf_counter()
+            with instrumented(f"{phase.__name__}_run{i + 1}"):
+                phase()
+            timings[phase.__name__].append(time.perf_counter() - start)
+    if write:
+        sync.save_mappings()
+    print(f"\n{'phase':<16}{'runs':>6}{'min s':>10}{'mean s':>10}{'max s':>10}")
+    for name, samples in timings.items():
+        print(f"{name:<16}{len(samples):>6}{min(samples):>10.3f}{sum(samples) / len(samples):>10.3f}{max(samples):>10.3f}")
+
+@app.command()
+def reconcile(
+    qbd: bool = typer.Option(False, "--qbd", help="Also check QuickBooks for unsynced records"),
+    buckets: int = typer.Option(RECONCILE_BUCKETS, min=1, max=MAX_BUCKETS, help="Number of hash buckets (a power of two)"),
+):
+    """Compare mappings and Filevine bucket digests and write a repair plan."""
+    with instrumented("reconcile"):
+        reconciler.reconcile(include_qbd=qbd, buckets=buckets)
+
+@app.command()
+def plan(
+    filevine_dir: Optional[str] = typer.Option(None, help="Filevine snapshot directory (default cache/snapshot, else cache)"),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="Diff file (default plan_<timestamp>.json)"),
+):
+    """Plan a sync offline from QuickBooks and Filevine snapshots; makes no network calls."""
+    with instrumented("plan"):
+        planner.plan_sync(filevine_dir, output)
+
+@app.command()
+def snapshot():
+    """Save QuickBooks lists and Filevine collections for offline planning."""
+    planner.take_snapshot()
+
+@app.command()
+def replay(
+    kind: Optional[list[str]] = typer.Option(None, help="Only replay this kind (customers, expenses, invoices, time_entries)"),
+    batch_size: int = typer.Option(replayer.REPLAY_BATCH_SIZE, min=1, help="Records re-sent per batch"),
+    max_attempts: Optional[int] = typer.Option(None, min=1, help="Skip records that already failed this many times"),
+    retries: int = typer.Option(replayer.REPLAY_RETRIES, min=0, help="Retries per failing batch"),
+    backoff: float = typer.Option(replayer.REPLAY_BACKOFF, min=0, help="First retry delay in seconds (doubles each retry)"),
+):
+    """Re-send only the records in the dead-letter queue."""
+    for name in kind or []:
+        if name not in replayer.SENDERS:
+            raise typer.BadParameter(f"Unknown kind {name}; expected one of {', '.join(replayer.SENDERS)}")
+    with instrumented("replay"):
+        replayer.replay(kind or None, batch_size, max_attempts, retries, backoff)
+
+@app.command("dead-letters")
+def show_dead_letters():
+    """Show what is waiting in the dead-letter queue."""
+    queued = dead_letters.summary()
+    if not queued:
+        print("Dead-letter queue is empty")
+    for name, stats in queued.items():
+        print(f"{name}: {stats['records']} records, up to {stats['max_attempts']} attempts, last error: {stats['last_reason']}")
+
+@app.command("clear-cache")
+def clear_cache(entity: Optional[str] = typer.Argument(None, help="Entity to drop, e.g. accounts (default: all)")):
+    """Drop cached QuickBooks lists for the end user."""
+    removed = qbd_cache.invalidate(sync.END_USER_ID, entity)
+    print(f"Removed {removed} cached QuickBooks list(s) for {sync.END_USER_ID}")
+
+@app.command("qwclog")
+def qwclog_report(
+    paths: list[str] = typer.Argument(None, help="QWCLog files or glob patterns (default logs/QWCLog*.txt)"),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="Write the report here instead of stdout"),
+    csv: bool = typer.Option(False, "--csv", help="Write one CSV row per session instead of JSON"),
+    sessions: bool = typer.Option(True, help="Include every session timeline in the JSON report"),
+):
+    """Summarize Web Connector sessions, SOAP call timings and errors from QWCLog files."""
+    patterns = paths or ["logs/QWCLog*.txt"]
+    files = [path for pattern in patterns for path in sorted(glob.glob(pattern))]
+    if not files:
+        print(f"No QWCLog files matched {patterns}")
+        raise typer.Exit(1)
+    summary = qwclog.analyze(files, output, "csv" if csv else "json", include_sessions=sessions)
+    if output:
+        print(f"{summary['sessions']} sessions, outcomes {summary['outcomes']}, errors {summary['errors'] or 'none'}")
+        print(f"Report written to {output}")
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,77 @@
+import os
+import json
+import sqlite3
+import threading
+
+# Durable dead-letter queue for Filevine creates that failed.
+#
+# One row per (kind, key), where kind is the qbd_to_filevine mapping the
+# record belongs to ("customers", "expenses", "invoices", "time_entries")
+# and key is its mapping key. A repeated failure updates the row in place
+# and bumps attempts, so the queue never holds duplicates. replay.py
+# re-sends only these rows.
+
+DEAD_LETTER_DB = os.path.join("cache", "dead_letters.db")
+
+lock = threading.Lock()
+connection = None
+
+def get_connection():
+    global connection
+    if connection is None:
+        os.makedirs(os.path.dirname(DEAD_LETTER_DB), exist_ok=True)
+        connection = sqlite3.connect(DEAD_LETTER_DB, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                reason TEXT,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                first_failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+    return connection
+
+# Record a failed create; safe to call from write threads
+def record(kind, key, payload, reason):
+    with lock:
+        get_connection().execute(
+            "INSERT INTO dead_letters (kind, key, payload, reason) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (kind, key) DO UPDATE SET payload = excluded.payload, reason = excluded.reason, "
+            "attempts = attempts + 1, last_failed_at = CURRENT_TIMESTAMP",
+            (kind, key, json.dumps(payload), reason)
+        )
+
+def resolve(kind, keys):
+    with lock:
+        get_connection().executemany(
+            "DELETE FROM dead_letters WHERE kind = ? AND key = ?", ((kind, key) for key in keys)
+        )
+
+# Up to limit rows of kind after rowid `after`, as (rowid, key, payload, attempts)
+def pending(kind, after=0, limit=100, max_attempts=None):
+    query = "SELECT rowid, key, payload, attempts FROM dead_letters WHERE kind = ? AND rowid > ?"
+    params = [kind, after]
+    if max_attempts:
+        query += " AND attempts < ?"
+        params.append(max_attempts)
+    query += " ORDER BY rowid LIMIT ?"
+    params.append(limit)
+    with lock:
+        rows = get_connection().execute(query, params).fetchall()
+    return [(rowid, key, json.loads(payload), attempts) for rowid, key, payload, attempts in rows]
+
+# Row counts and the most recent reason per kind
+def summary():
+    with lock:
+        rows = get_connection().execute(
+            "SELECT kind, COUNT(*), MAX(attempts), "
+            "(SELECT reason FROM dead_letters d2 WHERE d2.kind = d1.kind ORDER BY last_failed_at DESC LIMIT 1) "
+            "FROM dead_letters d1 GROUP BY kind ORDER BY kind"
+        ).fetchall()
+    return {kind: {"records": count, "max_attempts": attempts, "last_reason": reason}
+            for kind, count, attempts, reason in rows}
@@ -1,28 +1,50 @@
 import uuid
-from fastapi import FastAPI, HTTPException, Query
+import gzip
+import hashlib
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from datetime import datetime
 from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
 import json
 from pathlib import Path
 from typing import Optional, List
+from server.storage import open_storage
+from server.billing import MAX_BATCH_SIZE, create_batch, invoice_record, time_entry_record, update_batch
+from fingerprints import MAX_BUCKETS, RECONCILE_BUCKETS, bucket_digests, check_buckets, contact_fingerprint
 
-# Global data stores
-contacts = []
-expenses = []
-invoices = []
-time_entries = []
-sync_status = []
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
 
-# Persistent storage
+# Persistent storage (SQLite by default, see server/storage.py)
 base_dir = Path(__file__).resolve().parent  
 cache_dir = base_dir / "cache"
-cache_dir.mkdir(exist_ok=True)
-CONTACTS_FILE = cache_dir / "contacts.json"
-EXPENSES_FILE = cache_dir / "expenses.json"
-INVOICES_FILE = cache_dir / "invoices.json"
-TIME_ENTRIES_FILE = cache_dir / "time_entries.json"
-SYNC_STATUS_FILE = cache_dir / "sync_status.json"
+COLLECTIONS = {
+    "contacts": "personId",
+    "expenses": "expenseId",
+    "invoices": "invoiceId",
+    "time_entries": "entryId",
+    "sync_status": None
+}
+storage = None
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+# Encoded list bodies per collection, tagged with the ETag they were built for
+encoded_bodies = {}
+
+# Per-record fingerprints used by the reconciliation digests; collections
+# without one are compared by id only
+DIGEST_FINGERPRINTS = {
+    "contacts": contact_fingerprint,
+    "expenses": None
+}
+
+# Bucket digests per (collection, bucket count), tagged with the storage version
+digest_cache = {}
 
 # Pydantic models
 class TokenRequest(BaseModel):
@@ -38,13 +60,27 @@ class Contact(BaseModel):
     fullName: str
     email: Optional[str] = None
     personTypes: Optional[List[str]] = None
+    parentId: Optional[str] = None
+    sourceId: Optional[str] = None
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
     
+class ContactCreate(BaseModel):
+    personId: Optional[str] = None
+    fullName: str
+    email: Optional[str] = None
+    personTypes: Optional[List[str]] = None
+    parentId: Optional[str] = None
+    sourceId: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
 class ContactUpdate(BaseModel):
     fullName: Optional[str] = None
     email: Optional[str] = None
     personTypes: Optional[List[str]] = None
+    parentId: Optional[str] = None
+    sourceId: Optional[str] = None
 
 class Expense(BaseModel):
     expenseId: str
@@ -69,48 +105,178 @@ class ExpenseUpdate(BaseModel):
     date: Optional[str] = None
     category: Optional[str] = None
 
-class Invoice(BaseModel):
+class InvoiceLine(BaseModel):
+    description: Optional[str] = None
+    item: Optional[str] = None
+    quantity: Optional[float] = None
+    rate: Optional[float] = None
+    amount: Optional[float] = None
+
+class InvoiceCreate(BaseModel):
+    idempotencyKey: Optional[str] = None  # per-item key for batch creates
+    projectId: Optional[str] = None
+    sourceId: Optional[str] = None
+    invoiceNumber: Optional[str] = None
+    invoiceDate: Optional[str] = None
+    dueDate: Optional[str] = None
+    memo: Optional[str] = None
+    subtotal: Optional[float] = None
+    total: Optional[float] = None
+    balance: Optional[float] = None
+    lines: List[InvoiceLine] = []
+
+class Invoice(InvoiceCreate):
     invoiceId: str
-    created_at: str
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+class InvoiceBatch(BaseModel):
+    items: List[InvoiceCreate]
+
+class InvoiceUpdate(InvoiceCreate):
+    invoiceId: str
+
+class InvoiceUpdateBatch(BaseModel):
+    items: List[InvoiceUpdate]
 
-class TimeEntry(BaseModel):
+class TimeEntryCreate(BaseModel):
+    idempotencyKey: Optional[str] = None  # per-item key for batch creates
+    projectId: Optional[str] = None
+    sourceId: Optional[str] = None
+    date: Optional[str] = None
+    hours: Optional[float] = None
+    description: Optional[str] = None
+    timekeeper: Optional[str] = None
+    serviceItem: Optional[str] = None
+    billable: Optional[bool] = None
+    rate: Optional[float] = None
+
+class TimeEntry(TimeEntryCreate):
     entryId: str
-    created_at: str
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+class TimeEntryBatch(BaseModel):
+    items: List[TimeEntryCreate]
+
+class TimeEntryUpdate(TimeEntryCreate):
+    entryId: str
+
+class TimeEntryUpdateBatch(BaseModel):
+    items: List[TimeEntryUpdate]
 
 class SyncStatus(BaseModel):
     status: str
     last_sync: str
 
-# File I/O
-def load_data(file: Path) -> List:
-    print(f"Loading file: {file.resolve()}")
-    if file.exists():
+# Collection versions for conditional GETs come from the storage backend,
+# which bumps them on every write so all workers agree on them.
+def conditional_headers(request: Request, collection: str) -> dict:
+    version, modified = storage.version(collection)
+    if request.url.query:
+        # Filtered responses are a different representation of the collection
+        version += "-" + hashlib.sha1(request.url.query.encode("utf-8")).hexdigest()[:8]
+    return {"ETag": f'"{version}"', "Last-Modified": formatdate(modified, usegmt=True)}
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or headers["ETag"] in tags or f"W/{headers['ETag']}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
         try:
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                print(f"Loaded data: {data}")
-                return data
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-            return []
-    print(f"File not found: {file}")
-    return []
-
-def save_data(file: Path, data: List):
-    print(f"Saving to file: {file.resolve()}")
-    with open(file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return parsedate_to_datetime(headers["Last-Modified"]) <= since
+    return False
+
+# Fast serialization path: list bodies are encoded once per collection
+# version (orjson when available) and gzipped on demand, skipping the
+# per-record response_model validation.
+def encode_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+def accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            params = params.replace(" ", "").lower()
+            if params.startswith("q="):
+                try:
+                    return float(params[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+def json_response(request: Request, body: bytes, headers: dict, compressed: Optional[bytes] = None) -> Response:
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        return Response(compressed or gzip.compress(body), media_type="application/json", headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def collection_response(request: Request, collection: str, headers: dict) -> Response:
+    cached = encoded_bodies.get(collection)
+    if cached is None or cached["etag"] != headers["ETag"]:
+        cached = {"etag": headers["ETag"], "body": storage.dump(collection), "gzip": None}
+        encoded_bodies[collection] = cached
+    if len(cached["body"]) >= GZIP_MIN_SIZE and accepts_gzip(request) and cached["gzip"] is None:
+        cached["gzip"] = gzip.compress(cached["body"])
+    return json_response(request, cached["body"], headers, cached["gzip"])
+
+# Store a created record, or return the original result when the client
+# replays an Idempotency-Key it already used for this collection
+def create_record(collection: str, record: dict, result: dict, idempotency_key: Optional[str], response: Response) -> dict:
+    if not idempotency_key:
+        storage.insert(collection, record)
+        return result
+    stored, created = storage.insert_idempotent(collection, record, result, idempotency_key)
+    if not created:
+        response.headers["Idempotent-Replayed"] = "true"
+    return stored
+
+# Reconciliation: per-bucket digests of (id, fingerprint) let a client find
+# the few buckets that drifted and fetch only those. Only records the sync
+# created (see server/storage.py) are digested, matching what the client
+# can hash from its mappings.
+def collection_digest(collection: str, buckets: int) -> dict:
+    version, _ = storage.version(collection)
+    cached = digest_cache.get((collection, buckets))
+    if cached is not None and cached["version"] == version:
+        return cached
+    key = COLLECTIONS[collection]
+    fingerprint = DIGEST_FINGERPRINTS[collection]
+    digests, counts = bucket_digests(
+        ((r[key], fingerprint(r) if fingerprint else "") for r in storage.sourced(collection)), buckets
+    )
+    body = {"collection": collection, "buckets": buckets, "version": version, "digests": digests, "counts": counts}
+    if collection == "contacts":
+        body["duplicates"] = [{"fullName": name, "ids": ids} for name, ids in storage.duplicates(collection, "fullName")]
+    digest_cache[(collection, buckets)] = body
+    return body
+
+def valid_buckets(buckets: int) -> int:
+    try:
+        return check_buckets(buckets)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def records_in_bucket(collection: str, bucket: int, buckets: int) -> list:
+    if bucket >= valid_buckets(buckets):
+        raise HTTPException(status_code=400, detail=f"Bucket must be below {buckets}")
+    return storage.sourced_in_bucket(collection, bucket, buckets)
 
 # Lifespan handler
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global contacts, expenses, invoices, time_entries, sync_status
-    contacts = load_data(CONTACTS_FILE)
-    expenses = load_data(EXPENSES_FILE)
-    invoices = load_data(INVOICES_FILE)
-    time_entries = load_data(TIME_ENTRIES_FILE)
-    sync_status = load_data(SYNC_STATUS_FILE)
-    print("Loaded cached data on startup")
+    global storage
+    storage = open_storage(cache_dir, COLLECTIONS)
+    print("Opened storage on startup")
     yield
     print("Shutdown complete")
 
@@ -135,70 +301,85 @@ async def index():
         "endpoints": {
             "/core/contacts": "Manage contacts (GET, POST, PATCH)",
             "/core/expense": "Manage expenses (GET, POST, PATCH, DELETE)",
-            "/core/invoice": "Manage invoices (GET, POST)",
-            "/core/time": "Manage time entries (GET, POST)",
+            "/core/invoice": "Manage invoices (GET, POST; POST/PATCH /core/invoice/batch)",
+            "/core/time": "Manage time entries (GET, POST; POST/PATCH /core/time/batch)",
+            "/core/digest/{collection}": "Bucketed digests for reconciliation (GET)",
             "/connect/token": "Mock authentication (POST)",
             "/fv-app/v2/AccountingSync": "Sync billing items (PUT)"
         }
     }
 
+# Storage calls block on sqlite3 or the JSON file lock, so the endpoints
+# below are plain functions that FastAPI runs in its threadpool.
+
 # Contacts endpoints
 @app.get("/core/contacts", response_model=List[Contact])
-async def get_contacts(personId: Optional[str] = Query(None)):
-    contacts = load_data(CONTACTS_FILE)
+def get_contacts(request: Request, personId: Optional[str] = Query(None), updatedSince: Optional[str] = Query(None),
+                       bucket: Optional[int] = Query(None, ge=0), buckets: int = Query(RECONCILE_BUCKETS, ge=1)):
+    headers = conditional_headers(request, "contacts")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    if bucket is not None:
+        return json_response(request, encode_json(records_in_bucket("contacts", bucket, buckets)), headers)
+    if not personId and not updatedSince:
+        return collection_response(request, "contacts", headers)
     if personId:
-        for contact in contacts:
-            if contact["personId"] == personId:
-                return [contact]
-        raise HTTPException(status_code=404, detail="Contact not found")
-    return contacts
+        contact = storage.get("contacts", personId)
+        if contact is None:
+            raise HTTPException(status_code=404, detail="Contact not found")
+        return json_response(request, encode_json([contact]), headers)
+    return json_response(request, encode_json(storage.changed_since("contacts", updatedSince)), headers)
 
 @app.post("/core/contacts", response_model=dict)
-async def create_contact(data: Contact):
-    contacts = load_data(CONTACTS_FILE)
+def create_contact(data: ContactCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
     person_id = data.personId or str(uuid.uuid4())
     contact = {
         "personId": person_id,
         "fullName": data.fullName,
         "email": data.email,
         "personTypes": data.personTypes,
+        "parentId": data.parentId,
+        "sourceId": data.sourceId,
         "created_at": data.created_at or datetime.utcnow().isoformat(),
         "updated_at": data.updated_at or datetime.utcnow().isoformat()
     }
-    contacts.append(contact)
-    save_data(CONTACTS_FILE, contacts)
-    return {"personId": person_id}
+    return create_record("contacts", contact, {"personId": person_id}, idempotency_key, response)
 
 @app.patch("/core/contacts/{person_id}", response_model=dict)
-async def update_contact(person_id: str, data: ContactUpdate):
-    contacts = load_data(CONTACTS_FILE)
-    for contact in contacts:
-        if contact["personId"] == person_id:
-            if data.fullName:
-                contact["fullName"] = data.fullName
-            if data.email:
-                contact["email"] = data.email
-            if data.personTypes:
-                contact["personTypes"] = data.personTypes
-            contact["updated_at"] = datetime.utcnow().isoformat()
-            save_data(CONTACTS_FILE, contacts)
-            return {"personId": person_id}
-    raise HTTPException(status_code=404, detail="Contact not found")
+def update_contact(person_id: str, data: ContactUpdate):
+    # Every field the client sent is applied, so an explicit null clears it
+    changes = data.model_dump(exclude_unset=True)
+    if changes.get("fullName", "") is None:
+        raise HTTPException(status_code=422, detail="fullName cannot be cleared")
+    changes["updated_at"] = datetime.utcnow().isoformat()
+    if storage.update("contacts", person_id, changes) is None:
+        raise HTTPException(status_code=404, detail="Contact not found")
+    return {"personId": person_id}
+
+@app.get("/core/digest/{collection}", response_model=dict)
+def get_digest(collection: str, buckets: int = Query(RECONCILE_BUCKETS, ge=1, le=MAX_BUCKETS)):
+    if collection not in DIGEST_FINGERPRINTS:
+        raise HTTPException(status_code=404, detail="No digest for this collection")
+    return collection_digest(collection, valid_buckets(buckets))
 
 # Expense endpoints
 @app.get("/core/expense", response_model=List[Expense])
-async def get_expenses(expenseId: Optional[str] = Query(None)):
-    expenses = load_data(EXPENSES_FILE)
-    if expenseId:
-        for expense in expenses:
-            if expense["expenseId"] == expenseId:
-                return [expense]
+def get_expenses(request: Request, expenseId: Optional[str] = Query(None),
+                       bucket: Optional[int] = Query(None, ge=0), buckets: int = Query(RECONCILE_BUCKETS, ge=1)):
+    headers = conditional_headers(request, "expenses")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    if bucket is not None:
+        return json_response(request, encode_json(records_in_bucket("expenses", bucket, buckets)), headers)
+    if not expenseId:
+        return collection_response(request, "expenses", headers)
+    expense = storage.get("expenses", expenseId)
+    if expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
-    return expenses
+    return json_response(request, encode_json([expense]), headers)
 
 @app.post("/core/expense", response_model=dict)
-async def create_expense(data: ExpenseCreate):
-    expenses = load_data(EXPENSES_FILE)
+def create_expense(data: ExpenseCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
     expense_id = str(uuid.uuid4())
     expense = {
         "expenseId": expense_id,
@@ -210,78 +391,86 @@ async def create_expense(data: ExpenseCreate):
         "created_at": datetime.utcnow().isoformat(),
         "updated_at": datetime.utcnow().isoformat()
     }
-    expenses.append(expense)
-    save_data(EXPENSES_FILE, expenses)
-    return {"status": "success", "expenseId": expense_id}
+    return create_record("expenses", expense, {"status": "success", "expenseId": expense_id}, idempotency_key, response)
 
 @app.patch("/core/expense", response_model=dict)
-async def update_expense(expenseId: str = Query(...), data: ExpenseUpdate = None):
-    expenses = load_data(EXPENSES_FILE)
-    for expense in expenses:
-        if expense["expenseId"] == expenseId:
-            if data:
-                expense["description"] = data.description if data.description is not None else expense["description"]
-                expense["amount"] = data.amount if data.amount is not None else expense["amount"]
-                expense["date"] = data.date if data.date is not None else expense["date"]
-                expense["category"] = data.category if data.category is not None else expense["category"]
-            expense["updated_at"] = datetime.utcnow().isoformat()
-            save_data(EXPENSES_FILE, expenses)
-            return {"expenseId": expenseId}
-    raise HTTPException(status_code=404, detail="Expense not found")
+def update_expense(expenseId: str = Query(...), data: ExpenseUpdate = None):
+    changes = {"updated_at": datetime.utcnow().isoformat()}
+    if data:
+        changes.update(data.model_dump(exclude_none=True))
+    if storage.update("expenses", expenseId, changes) is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    return {"expenseId": expenseId}
 
 @app.delete("/core/expense", response_model=dict)
-async def delete_expense(expenseId: str = Query(...)):
-    expenses = load_data(EXPENSES_FILE)
-    for i, expense in enumerate(expenses):
-        if expense["expenseId"] == expenseId:
-            expenses.pop(i)
-            save_data(EXPENSES_FILE, expenses)
-            return {"status": "success"}
-    raise HTTPException(status_code=404, detail="Expense not found")
-
-# Invoice endpoints (placeholder)
+def delete_expense(expenseId: str = Query(...)):
+    if not storage.delete("expenses", expenseId):
+        raise HTTPException(status_code=404, detail="Expense not found")
+    return {"status": "success"}
+
+def check_batch_size(items: list):
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {MAX_BATCH_SIZE} items")
+
+# Invoice endpoints
 @app.get("/core/invoice", response_model=List[Invoice])
-async def get_invoices():
-    invoices = load_data(INVOICES_FILE)
-    return invoices
+def get_invoices(request: Request, projectId: Optional[str] = Query(None)):
+    headers = conditional_headers(request, "invoices")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    if projectId:
+        return json_response(request, encode_json(storage.by_project("invoices", projectId)), headers)
+    return collection_response(request, "invoices", headers)
 
 @app.post("/core/invoice", response_model=dict)
-async def create_invoice(data: Invoice):
-    invoices = load_data(INVOICES_FILE)
-    invoice_id = str(uuid.uuid4())
-    invoice = {
-        "invoiceId": invoice_id,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    invoices.append(invoice)
-    save_data(INVOICES_FILE, invoices)
-    return {"invoiceId": invoice_id}
+def create_invoice(data: InvoiceCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
+    invoice = invoice_record(data.model_dump())
+    return create_record("invoices", invoice, {"invoiceId": invoice["invoiceId"]}, idempotency_key, response)
+
+@app.post("/core/invoice/batch", response_model=dict)
+def create_invoices(data: InvoiceBatch):
+    check_batch_size(data.items)
+    items = [item.model_dump() for item in data.items]
+    return {"results": create_batch(storage, "invoices", "invoiceId", invoice_record, items)}
+
+@app.patch("/core/invoice/batch", response_model=dict)
+def update_invoices(data: InvoiceUpdateBatch):
+    check_batch_size(data.items)
+    items = [item.model_dump(exclude_unset=True) for item in data.items]
+    return {"results": update_batch(storage, "invoices", "invoiceId", items)}
 
-# Time entry endpoints (placeholder)
+# Time entry endpoints
 @app.get("/core/time", response_model=List[TimeEntry])
-async def get_time_entries():
-    time_entries = load_data(TIME_ENTRIES_FILE)
-    return time_entries
+def get_time_entries(request: Request, projectId: Optional[str] = Query(None)):
+    headers = conditional_headers(request, "time_entries")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    if projectId:
+        return json_response(request, encode_json(storage.by_project("time_entries", projectId)), headers)
+    return collection_response(request, "time_entries", headers)
 
 @app.post("/core/time", response_model=dict)
-async def create_time_entry(data: TimeEntry):
-    time_entries = load_data(TIME_ENTRIES_FILE)
-    entry_id = str(uuid.uuid4())
-    entry = {
-        "entryId": entry_id,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    time_entries.append(entry)
-    save_data(TIME_ENTRIES_FILE, time_entries)
-    return {"entryId": entry_id}
+def create_time_entry(data: TimeEntryCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
+    entry = time_entry_record(data.model_dump())
+    return create_record("time_entries", entry, {"entryId": entry["entryId"]}, idempotency_key, response)
+
+@app.post("/core/time/batch", response_model=dict)
+def create_time_entries(data: TimeEntryBatch):
+    check_batch_size(data.items)
+    items = [item.model_dump() for item in data.items]
+    return {"results": create_batch(storage, "time_entries", "entryId", time_entry_record, items)}
+
+@app.patch("/core/time/batch", response_model=dict)
+def update_time_entries(data: TimeEntryUpdateBatch):
+    check_batch_size(data.items)
+    items = [item.model_dump(exclude_unset=True) for item in data.items]
+    return {"results": update_batch(storage, "time_entries", "entryId", items)}
 
 # Accounting sync endpoint (placeholder)
 @app.put("/fv-app/v2/AccountingSync", response_model=dict)
-async def accounting_sync(data: SyncStatus):
-    sync_status = load_data(SYNC_STATUS_FILE)
-    sync_status.append({
+def accounting_sync(data: SyncStatus):
+    storage.insert("sync_status", {
         "status": data.status,
         "last_sync": data.last_sync
     })
-    save_data(SYNC_STATUS_FILE, sync_status)
     return {"status": "success"}
\ No newline at end of file
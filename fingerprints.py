@@ -0,0 +1,48 @@
+import hashlib
+import json
+
+# Content fingerprints and bucket digests shared by sync.py, reconcile.py
+# and the mock server, so both sides hash records the same way.
+
+# Fields compared to decide whether a contact needs to be rewritten
+CONTACT_SYNC_FIELDS = ("fullName", "email", "personTypes")
+
+# Fields that link a Filevine contact to its QBD customer; tracked apart
+# from the fingerprint so they never count as a content change
+CONTACT_LINK_FIELDS = ("sourceId", "parentId")
+
+# Default number of hash buckets used by reconciliation
+RECONCILE_BUCKETS = 64
+
+# The mock server stores every record's bucket out of MAX_BUCKETS; any
+# power-of-two bucket count up to it maps onto those stored buckets
+MAX_BUCKETS = 4096
+
+# Hash the synced contact fields so unchanged records can be skipped
+def contact_fingerprint(record):
+    synced = {field: record.get(field) for field in CONTACT_SYNC_FIELDS}
+    if synced["personTypes"]:
+        synced["personTypes"] = sorted(synced["personTypes"])
+    encoded = json.dumps(synced, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+# Stable bucket for a record id, independent of Python's hash seed
+def bucket_of(record_id, buckets):
+    return int(hashlib.sha1(record_id.encode("utf-8")).hexdigest()[:8], 16) % buckets
+
+def check_buckets(buckets):
+    if buckets < 1 or buckets > MAX_BUCKETS or buckets & (buckets - 1):
+        raise ValueError(f"Bucket count must be a power of two between 1 and {MAX_BUCKETS}, got {buckets}")
+    return buckets
+
+# Stored buckets (out of MAX_BUCKETS) that make up bucket `bucket` of `buckets`
+def stored_buckets(bucket, buckets):
+    return list(range(bucket, MAX_BUCKETS, check_buckets(buckets)))
+
+# Digest and record count per bucket for an iterable of (id, fingerprint) pairs
+def bucket_digests(pairs, buckets):
+    grouped = [[] for _ in range(buckets)]
+    for record_id, fingerprint in pairs:
+        grouped[bucket_of(record_id, buckets)].append(f"{record_id}:{fingerprint or ''}")
+    digests = [hashlib.sha1("\n".join(sorted(lines)).encode("utf-8")).hexdigest() for lines in grouped]
+    return digests, [len(lines) for lines in grouped]
@@ -0,0 +1,48 @@
+from collections import deque
+
+# Customer:Job hierarchy for QBD customers.
+#
+# QBD jobs are customers whose full name is "Parent:Job" (any depth) and
+# whose parent reference points at the customer above them. The index is
+# built once per run in O(n) and gives parent/children links, each
+# customer's depth, and a topological order in which every parent comes
+# before its jobs.
+
+def parent_id_of(customer, ids_by_full_name):
+    parent = getattr(customer, 'parent', None)
+    parent_id = getattr(parent, 'id', None) if parent else None
+    if parent_id:
+        return parent_id
+    # Older payloads carry no parent ref; fall back to the full-name prefix
+    full_name = getattr(customer, 'full_name', None) or ""
+    if ":" in full_name:
+        return ids_by_full_name.get(full_name.rsplit(":", 1)[0])
+    return None
+
+def build_customer_index(customers):
+    by_id = {c.id: c for c in customers if getattr(c, 'id', None)}
+    ids_by_full_name = {getattr(c, 'full_name', None): customer_id for customer_id, c in by_id.items()}
+    parent = {}
+    children = {}
+    for customer_id, customer in by_id.items():
+        parent_id = parent_id_of(customer, ids_by_full_name)
+        if parent_id in by_id and parent_id != customer_id:
+            parent[customer_id] = parent_id
+            children.setdefault(parent_id, []).append(customer_id)
+
+    # Breadth-first from the roots; customers whose parent is missing from
+    # the list are treated as roots
+    depth = {}
+    order = []
+    queue = deque((customer_id, 0) for customer_id in by_id if customer_id not in parent)
+    while queue:
+        customer_id, level = queue.popleft()
+        depth[customer_id] = level
+        order.append(by_id[customer_id])
+        queue.extend((child_id, level + 1) for child_id in children.get(customer_id, []))
+    # Parent cycles are never reachable from a root; append them unordered
+    for customer_id, customer in by_id.items():
+        if customer_id not in depth:
+            depth[customer_id] = 0
+            order.append(customer)
+    return {"by_id": by_id, "parent": parent, "children": children, "depth": depth, "order": order}
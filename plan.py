@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+from pathlib import Path
+import sync
+import qbd_cache
+from fingerprints import contact_fingerprint
+from hierarchy import build_customer_index
+from server.storage import DB_NAME, JsonStorage
+
+# Offline sync planning.
+#
+# Computes what sync() would do from local snapshots only: QBD lists in the
+# qbd_cache directory (written by normal runs or `cli.py snapshot`), the
+# Filevine collections in FILEVINE_DIR (the mock's filevine.db, or
+# its per-collection JSON files) and the latest mappings file. Every join is
+# a dict lookup, so a plan over 100k invoice lines takes seconds, and no
+# network call is made. The creates and updates are written to
+# plan_<timestamp>.json; skips are counted by reason.
+
+# Default Filevine snapshot location; `cli.py snapshot` writes SNAPSHOT_DIR
+FILEVINE_DIR = "cache"
+SNAPSHOT_DIR = os.path.join("cache", "snapshot")
+
+FILEVINE_COLLECTIONS = {"contacts": "personId", "expenses": "expenseId",
+                        "invoices": "invoiceId", "time_entries": "entryId"}
+
+def load_filevine(directory, name):
+    db_path = os.path.join(directory, DB_NAME)
+    if os.path.exists(db_path):
+        # Read-only, so planning never touches the mock server's database
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT body FROM records WHERE collection = ? ORDER BY rowid", (name,))
+            return [json.loads(body) for body, in rows]
+        finally:
+            conn.close()
+    return JsonStorage(Path(directory), FILEVINE_COLLECTIONS).all(name)
+
+def load_qbd(entity):
+    records = qbd_cache.snapshot(sync.END_USER_ID, entity)
+    if records is None:
+        print(f"No QBD {entity} snapshot in {qbd_cache.CACHE_DIR}; run `cli.py snapshot` first")
+        return []
+    return qbd_cache.from_json(records)
+
+# Field-level differences between a Filevine record and a planned payload
+def diff(before, after):
+    return {key: [before.get(key), value] for key, value in after.items() if before.get(key) != value}
+
+def add_change(plan, entity, action, **details):
+    plan["changes"].append({"entity": entity, "action": action, **details})
+
+# Skips are only counted; a full run is mostly skips
+def add_skip(plan, entity, reason):
+    key = f"{entity}: {reason}"
+    plan["skips"][key] = plan["skips"].get(key, 0) + 1
+
+def summarize(plan):
+    counts = {}
+    for change in plan["changes"]:
+        key = f"{change['entity']}: {change['action']}"
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+# Mirror of sync_contacts_from_filevine: Filevine edits past the watermark
+# that would be written back to QBD, and new conflicts
+def plan_reverse(plan, customers_by_id, contacts, conflicts):
+    fingerprints = sync.qbd_to_filevine["fingerprints"]["customers"]
+    since = sync.qbd_to_filevine["watermarks"].get("contacts")
+    filevine_to_qbd = {person_id: qbd_id for qbd_id, person_id in sync.qbd_to_filevine["customers"].items()}
+    written_back = set()
+    for contact in contacts:
+        if since and (contact.get("updated_at") or "") <= since:
+            continue
+        qbd_id = filevine_to_qbd.get(contact.get("personId"))
+        stored = fingerprints.get(qbd_id)
+        if qbd_id not in customers_by_id or stored is None:
+            continue
+        filevine_fingerprint = contact_fingerprint(contact)
+        if stored.get("filevine") == filevine_fingerprint:
+            continue
+        customer = customers_by_id[qbd_id]
+        payload = sync.customer_payload(customer)
+        if contact_fingerprint(payload) == filevine_fingerprint:
+            continue
+        if stored.get("qbd") != contact_fingerprint(payload):
+            conflicts[qbd_id] = {"filevine": filevine_fingerprint}
+            add_change(plan, "customer", "conflict", qbdId=qbd_id, personId=contact["personId"],
+                       qbdFullName=customer.full_name, filevineFullName=contact.get("fullName"))
+            continue
+        # Predict what QBD will hold after the write-back; the rest becomes a conflict
+        fields = sync.qbd_update_fields(customer, contact)
+        expected = dict(payload)
+        if "name" in fields:
+            prefix = customer.full_name.rpartition(":")[0]
+            expected["fullName"] = f"{prefix}:{fields['name']}" if prefix else fields["name"]
+        if "email" in fields:
+            expected["email"] = fields["email"]
+        partial = contact_fingerprint(expected) != filevine_fingerprint
+        if partial:
+            conflicts[qbd_id] = {"filevine": filevine_fingerprint}
+        else:
+            written_back.add(qbd_id)
+        add_change(plan, "customer", "update_qbd", qbdId=qbd_id, personId=contact["personId"],
+                   partial=partial, changes=diff(payload, expected))
+    return written_back
+
+# Mirror of sync_customers; returns the mapping as it would be after the run
+def plan_customers(plan, index, contacts_by_id, written_back, conflicts):
+    mapping = sync.qbd_to_filevine["customers"]
+    fingerprints = sync.qbd_to_filevine["fingerprints"]["customers"]
+    contacts_by_name = {c.get("fullName"): c for c in contacts_by_id.values()}
+    planned = dict(mapping)
+    for customer in index["order"]:
+        customer_id = customer.id
+        payload = sync.customer_payload(customer)
+        fingerprint = contact_fingerprint(payload)
+        if customer_id in written_back:
+            add_skip(plan, "customer", "updated from Filevine this run")
+            continue
+        if customer_id in conflicts and conflicts[customer_id]["filevine"] != fingerprint:
+            add_skip(plan, "customer", "conflict")
+            continue
+        if customer_id in mapping:
+            person_id = mapping[customer_id]
+            contact = contacts_by_id.get(person_id)
+            stored = fingerprints.get(customer_id)
+            if stored is None and contact is not None:
+                stored = {"qbd": contact_fingerprint(contact)}
+            link = sync.contact_link(customer_id, index)
+            if stored is not None and stored.get("qbd") == fingerprint:
+                if stored.get("link") == link:
+                    add_skip(plan, "customer", "unchanged")
+                else:
+                    add_change(plan, "customer", "link", qbdId=customer_id, personId=person_id,
+                               changes=diff(contact or {}, link))
+                continue
+            add_change(plan, "customer", "update", qbdId=customer_id, personId=person_id,
+                       missingInFilevine=contact is None, changes=diff(contact or {}, {**payload, **link}))
+            continue
+        payload.update(sync.contact_link(customer_id, index))
+        parent_id = index["parent"].get(customer_id)
+        if parent_id in planned:
+            payload["parentId"] = planned[parent_id]
+        elif index["depth"][customer_id]:
+            add_skip(plan, "customer", "parent not synced")
+            continue
+        existing = contacts_by_name.get(payload["fullName"])
+        add_change(plan, "customer", "create", qbdId=customer_id, payload=payload,
+                   sameNameAs=existing.get("personId") if existing else None)
+        planned[customer_id] = f"new:{customer_id}"
+    return planned
+
+# Mirror of sync_expenses against the planned mapping
+def plan_expenses(plan, planned_mapping, invoices, accounts, expense_ids):
+    account_names = dict(sync.qbd_to_filevine["accounts"])
+    for account in accounts:
+        if getattr(account, 'account_type', '').lower() == 'expense' and getattr(account, 'id', None):
+            account_names.setdefault(account.id, account.full_name)
+    expenses = sync.qbd_to_filevine["expenses"]
+    for invoice in invoices:
+        customer_ref = getattr(invoice, 'customer', None)
+        customer_id = getattr(customer_ref, 'id', None) if customer_ref else None
+        project_id = planned_mapping.get(customer_id)
+        for line, expense_key in sync.expense_lines(invoice):
+            if expense_key in expenses:
+                if expenses[expense_key] in expense_ids:
+                    add_skip(plan, "expense", "already synced")
+                else:
+                    add_skip(plan, "expense", "mapped but missing in Filevine snapshot")
+                continue
+            if project_id is None:
+                add_skip(plan, "expense", "customer not synced")
+                continue
+            add_change(plan, "expense", "create", expenseKey=expense_key,
+                       payload=sync.expense_payload(invoice, line, project_id, account_names))
+
+# Mirror of sync_billing. The sync only streams records changed since the
+# watermark plus the pending ones; the plan diffs every record in the
+# snapshot, so it also shows drift the next run would not repair.
+def plan_billing(plan, kind, planned_mapping, records, filevine_records):
+    pipeline = sync.BILLING_PIPELINES[kind]
+    mapping = sync.qbd_to_filevine[kind]
+    by_id = {r[pipeline["id_field"]]: r for r in filevine_records if r.get(pipeline["id_field"])}
+    for record in records:
+        customer = getattr(record, 'customer', None)
+        if customer is None:
+            add_skip(plan, kind, "no customer")
+            continue
+        project_id = planned_mapping.get(getattr(customer, 'id', None))
+        if project_id is None:
+            add_skip(plan, kind, "customer not synced")
+            continue
+        payload = pipeline["payload"](record, project_id)
+        filevine_id = mapping.get(record.id)
+        if filevine_id is None:
+            add_change(plan, kind, "create", qbdId=record.id, payload=payload)
+            continue
+        existing = by_id.get(filevine_id)
+        changes = diff(existing or {}, payload)
+        if existing is not None and not changes:
+            add_skip(plan, kind, "unchanged")
+            continue
+        add_change(plan, kind, "update", qbdId=record.id, filevineId=filevine_id,
+                   missingInFilevine=existing is None, changes=changes)
+
+def plan_sync(filevine_dir=None, output=None):
+    start = time.perf_counter()
+    filevine_dir = filevine_dir or (SNAPSHOT_DIR if os.path.isdir(SNAPSHOT_DIR) else FILEVINE_DIR)
+    sync.load_mappings()
+    customers = load_qbd("customers")
+    accounts = load_qbd("accounts")
+    invoices = load_qbd("invoices")
+    activities = load_qbd("time_tracking_activities")
+    contacts = load_filevine(filevine_dir, "contacts")
+    expense_ids = {e.get("expenseId") for e in load_filevine(filevine_dir, "expenses")}
+    filevine_invoices = load_filevine(filevine_dir, "invoices")
+    time_entries = load_filevine(filevine_dir, "time_entries")
+    print(f"Planning from {len(customers)} customers, {len(invoices)} invoices, {len(activities)} time entries, "
+          f"{len(contacts)} Filevine contacts, {len(expense_ids)} expenses, {len(filevine_invoices)} invoices "
+          f"and {len(time_entries)} time entries ({filevine_dir})")
+
+    plan = {"changes": [], "skips": {}}
+    index = build_customer_index(customers)
+    conflicts = {qbd_id: dict(c) for qbd_id, c in sync.qbd_to_filevine["conflicts"]["customers"].items()}
+    written_back = plan_reverse(plan, index["by_id"], contacts, conflicts)
+    contacts_by_id = {c["personId"]: c for c in contacts if c.get("personId")}
+    planned_mapping = plan_customers(plan, index, contacts_by_id, written_back, conflicts)
+    plan_expenses(plan, planned_mapping, invoices, accounts, expense_ids)
+    plan_billing(plan, "invoices", planned_mapping, invoices, filevine_invoices)
+    plan_billing(plan, "time_entries", planned_mapping, activities, time_entries)
+
+    summary = summarize(plan)
+    output = output or f"plan_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump({
+            "generated_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "filevine_dir": filevine_dir,
+            "summary": summary,
+            "skips": plan["skips"],
+            "changes": plan["changes"]
+        }, f, indent=2)
+    print(f"Planned {len(plan['changes'])} changes in {time.perf_counter() - start:.2f}s")
+    for key, count in sorted(summary.items()):
+        print(f"  {key}: {count}")
+    for key, count in sorted(plan["skips"].items()):
+        print(f"  skip {key}: {count}")
+    print(f"Plan written to {output}")
+    return plan
+
+# Refresh the snapshots plan_sync reads: QBD lists into the qbd_cache
+# directory and the Filevine collections into SNAPSHOT_DIR. This is the
+# only part of planning that talks to Conductor and Filevine.
+def take_snapshot():
+    for entity, paginated in (("customers", True), ("accounts", False), ("invoices", True),
+                              ("time_tracking_activities", True)):
+        records = sync.list_qbd(getattr(sync.get_conductor().qbd, entity), paginated)
+        print(f"Saved {qbd_cache.store(sync.END_USER_ID, entity, records)} QBD {entity}")
+    headers = sync.filevine_headers()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for name, path in (("contacts", "/core/contacts"), ("expenses", "/core/expense"),
+                       ("invoices", "/core/invoice"), ("time_entries", "/core/time")):
+        records = sync.get_collection(path, headers)
+        with open(os.path.join(SNAPSHOT_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        print(f"Saved {len(records)} Filevine {name} to {SNAPSHOT_DIR}")
+    sync.save_http_cache()
+
+def main():
+    plan_sync(sys.argv[1] if len(sys.argv) > 1 else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import hashlib
+from types import SimpleNamespace
+
+# Read-through cache for Conductor list results.
+#
+# Each (end user, entity, params) list is stored as JSON under
+# CACHE_DIR/<end user>/<entity>.json together with the time it was fetched.
+# A fresh entry is served without touching Conductor. A stale entry is
+# revalidated with updated_after=<last fetch> where the entity supports it,
+# so only changed records cross the QuickBooks Desktop connection; entries
+# older than FULL_REFRESH_AFTER (or any entry after refresh/invalidate) are
+# re-listed in full so deletions are picked up. Cached records come back as
+# SimpleNamespace objects, so attribute access works like Conductor models.
+
+CACHE_DIR = os.path.join("cache", "qbd")
+
+# Seconds a cached list is served without asking Conductor; 0 disables caching
+TTLS = {
+    "accounts": 24 * 60 * 60,  # chart of accounts almost never changes
+    "customers": 15 * 60,
+    "invoices": 0
+}
+
+# Entities whose Conductor list endpoint accepts updated_after
+REVALIDATE = {"accounts", "customers"}
+
+# Stale entries older than this are re-listed in full instead of revalidated
+FULL_REFRESH_AFTER = 7 * 24 * 60 * 60
+
+# Overlap subtracted from updated_after to absorb clock skew with the QBD machine
+REVALIDATE_OVERLAP = 5 * 60
+
+# Config: Ignore cached lists for this run (the fresh results are still stored)
+REFRESH = False
+
+def cache_path(end_user, entity, params=None):
+    name = entity
+    if params:
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:8]
+        name = f"{entity}-{digest}"
+    return os.path.join(CACHE_DIR, end_user, f"{name}.json")
+
+# Plain JSON form of a Conductor model (or an already rehydrated record)
+def to_json(record):
+    if hasattr(record, "model_dump"):
+        return record.model_dump(mode="json")
+    if isinstance(record, SimpleNamespace):
+        return {key: to_json(value) for key, value in vars(record).items()}
+    if isinstance(record, list):
+        return [to_json(value) for value in record]
+    if isinstance(record, dict):
+        return {key: to_json(value) for key, value in record.items()}
+    return record
+
+def from_json(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: from_json(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    return value
+
+def load_entry(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Failed to load QBD cache {path}: {e}")
+        return None
+
+def save_entry(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def updated_after(fetched_at):
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(fetched_at - REVALIDATE_OVERLAP))
+
+# Merge changed records into the cached list by id, keeping list order
+def merge(records, changed):
+    positions = {record.get("id"): i for i, record in enumerate(records)}
+    for record in changed:
+        if record.get("id") in positions:
+            records[positions[record["id"]]] = record
+        else:
+            records.append(record)
+    return records
+
+# Return the list for entity, calling fetch(**params) only when the cached
+# copy is missing or stale
+def read_through(end_user, entity, fetch, params=None):
+    params = params or {}
+    ttl = TTLS.get(entity, 0)
+    if ttl <= 0:
+        return fetch(**params)
+    path = cache_path(end_user, entity, params)
+    entry = None if REFRESH else load_entry(path)
+    now = time.time()
+    if entry and now - entry["fetched_at"] < ttl and not entry.get("expired"):
+        print(f"Using cached QBD {entity} ({len(entry['records'])} records, {int(now - entry['fetched_at'])}s old)")
+        return from_json(entry["records"])
+
+    if entry and entity in REVALIDATE and now - entry["fetched_at"] < FULL_REFRESH_AFTER:
+        changed = [to_json(record) for record in fetch(updated_after=updated_after(entry["fetched_at"]), **params)]
+        records = merge(entry["records"], changed)
+        print(f"Revalidated cached QBD {entity}: {len(changed)} changed of {len(records)}")
+    else:
+        records = [to_json(record) for record in fetch(**params)]
+    save_entry(path, {"fetched_at": now, "params": params, "records": records})
+    return from_json(records)
+
+# Store a full list regardless of TTL (used for offline planning snapshots)
+def store(end_user, entity, records, params=None):
+    records = [to_json(record) for record in records]
+    save_entry(cache_path(end_user, entity, params), {"fetched_at": time.time(), "params": params or {}, "records": records})
+    return len(records)
+
+# Cached list as plain dicts, however old, or None if never fetched
+def snapshot(end_user, entity, params=None):
+    entry = load_entry(cache_path(end_user, entity, params))
+    return entry["records"] if entry else None
+
+# Force the next read of entity to revalidate (e.g. after writing to QBD)
+def expire(end_user, entity, params=None):
+    path = cache_path(end_user, entity, params)
+    entry = load_entry(path)
+    if entry:
+        entry["expired"] = True
+        save_entry(path, entry)
+
+# Drop cached lists for one entity (or every entity) of an end user
+def invalidate(end_user, entity=None):
+    directory = os.path.join(CACHE_DIR, end_user)
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for name in os.listdir(directory):
+        if entity is None or name == f"{entity}.json" or name.startswith(f"{entity}-"):
+            os.remove(os.path.join(directory, name))
+            removed += 1
+    return removed
@@ -0,0 +1,248 @@
+import re
+import sys
+import csv
+import json
+import glob
+from datetime import datetime
+
+# Streaming parser for QuickBooks Web Connector logs (QWCLog.txt).
+#
+# Each log line looks like
+#   20250519.13:33:54 UTC	: QBWebConnector.SOAPWebService.do_authenticate() : *** Calling authenticate() ...
+# Lines without a timestamp (XML dumps, banners) are skipped. Lines are
+# grouped into sessions: a scheduled update starts with "Password
+# management - Started", a manual one with "updateWS() ... has STARTED"
+# and adding an application with "Connecting to QuickBooks...".
+# Only one session is held in memory at a time, so multi-megabyte logs
+# stream in constant space.
+
+LINE_RE = re.compile(r"^(\d{8}\.\d{2}:\d{2}:\d{2}) UTC\t: (.*?) : (.*)$")
+CALL_RE = re.compile(r"\*\*\* Calling (\w+)\(")
+RETURN_RE = re.compile(r"Received from (\w+)\(\)")
+AUTH_RET_RE = re.compile(r'<authRet\[(\d)\]="([^"]*)">')
+POSTPONED_RE = re.compile(r"postponed .* for next (\d+) seconds")
+# "application = X has STARTED", "Application name = X" and QBWC1030's
+# "application named 'X'. Please set password ..."
+APP_RE = re.compile(r"application(?: name)?(?: =| named) '?([^']+?)'?(?: has STARTED|\. .*)?$", re.IGNORECASE)
+CODE_RE = re.compile(r"\b(QBWC\d{4})\b")
+
+# Message markers that open a new session, and the session kind they start
+SESSION_STARTS = {
+    "Password management - Started": "scheduled",
+    "has STARTED": "manual",
+    "Connecting to QuickBooks...": "connect"
+}
+
+CSV_FIELDS = [
+    "session", "kind", "app", "started_at", "ended_at", "duration_s", "outcome",
+    "auth_status", "delay_s", "postponed_s", "calls", "call_time_s", "gap_time_s",
+    "max_gap_s", "errors"
+]
+
+def parse_timestamp(value):
+    return datetime.strptime(value, "%Y%m%d.%H:%M:%S")
+
+def new_session(number, kind, at):
+    return {
+        "session": number,
+        "kind": kind,
+        "app": None,
+        "started_at": at,
+        "ended_at": at,
+        "outcome": "incomplete",
+        "auth_status": None,
+        "delay_s": None,
+        "postponed_s": None,
+        "calls": [],
+        "errors": {},
+        "_open_calls": {},
+        "_last_return": None
+    }
+
+def count_error(session, kind):
+    session["errors"][kind] = session["errors"].get(kind, 0) + 1
+
+# Apply one log event to the current session
+def apply_event(session, at, source, message):
+    call = CALL_RE.search(message)
+    if call:
+        method = call.group(1)
+        gap = (at - session["_last_return"]).total_seconds() if session["_last_return"] else None
+        session["_open_calls"][method] = (at, gap)
+        session["ended_at"] = at
+        return
+    returned = RETURN_RE.search(message)
+    if returned:
+        method = returned.group(1)
+        started, gap = session["_open_calls"].pop(method, (at, None))
+        session["calls"].append({
+            "method": method,
+            "started_at": started,
+            "duration_s": (at - started).total_seconds(),
+            "gap_before_s": gap
+        })
+        session["_last_return"] = at
+        session["ended_at"] = at
+        if method == "authenticate":
+            auth = dict(AUTH_RET_RE.findall(message))
+            session["auth_status"] = auth.get("1")
+            if auth.get("2", "").isdigit():
+                session["delay_s"] = int(auth["2"])
+        if method in ("getLastError", "connectionError"):
+            count_error(session, method)
+        return
+    if session["app"] is None and "application" in message.lower():
+        app = APP_RE.search(message)
+        if app:
+            session["app"] = app.group(1).strip()
+    postponed = POSTPONED_RE.search(message)
+    if postponed:
+        session["postponed_s"] = int(postponed.group(1))
+        session["ended_at"] = at
+    code = CODE_RE.search(message)
+    if code:
+        count_error(session, code.group(1))
+        session["ended_at"] = at
+        if session["outcome"] == "incomplete":
+            session["outcome"] = "error"
+    elif "No data to exchange" in message:
+        session["outcome"] = "no_data"
+        session["ended_at"] = at
+    elif "Update completed with errors" in message:
+        session["outcome"] = "error"
+        session["ended_at"] = at
+    elif "Update completed successfully" in message or "Update completed." in message:
+        session["outcome"] = "ok"
+        session["ended_at"] = at
+    elif "Not a valid username and password" in message:
+        count_error(session, "invalid_credentials")
+    elif "failed to connect" in message:
+        count_error(session, "connection")
+        session["ended_at"] = at
+    elif "Enter a password" in message:
+        count_error(session, "password_required")
+        session["ended_at"] = at
+    elif "has been added to QuickBooks" in message:
+        session["outcome"] = "ok"
+        session["ended_at"] = at
+    elif "Connected., Session started" in message:
+        session["ended_at"] = at
+
+def finish_session(session):
+    session.pop("_open_calls")
+    session.pop("_last_return")
+    session["duration_s"] = (session["ended_at"] - session["started_at"]).total_seconds()
+    gaps = [c["gap_before_s"] for c in session["calls"] if c["gap_before_s"] is not None]
+    session["call_time_s"] = sum(c["duration_s"] for c in session["calls"])
+    session["gap_time_s"] = sum(gaps)
+    session["max_gap_s"] = max(gaps) if gaps else 0
+    return session
+
+# Yield one finished session at a time from one or more QWCLog files
+def iter_sessions(paths):
+    session = None
+    number = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = LINE_RE.match(line.rstrip("\r\n"))
+                if not match:
+                    continue
+                at = parse_timestamp(match.group(1))
+                source, message = match.group(2), match.group(3)
+                start = next((s for s in SESSION_STARTS if s in message), None)
+                if start:
+                    if session is not None:
+                        yield finish_session(session)
+                    number += 1
+                    session = new_session(number, SESSION_STARTS[start], at)
+                if session is not None:
+                    apply_event(session, at, source, message)
+    if session is not None:
+        yield finish_session(session)
+
+def new_summary():
+    return {"sessions": 0, "outcomes": {}, "methods": {}, "errors": {}, "delays_s": {},
+            "total_duration_s": 0, "total_gap_s": 0, "slowest_sessions": []}
+
+# Fold one session into the running summary
+def add_to_summary(summary, session, slowest=10):
+    summary["sessions"] += 1
+    summary["outcomes"][session["outcome"]] = summary["outcomes"].get(session["outcome"], 0) + 1
+    summary["total_duration_s"] += session["duration_s"]
+    summary["total_gap_s"] += session["gap_time_s"]
+    for call in session["calls"]:
+        stats = summary["methods"].setdefault(call["method"], {"count": 0, "total_s": 0, "max_s": 0})
+        stats["count"] += 1
+        stats["total_s"] += call["duration_s"]
+        stats["max_s"] = max(stats["max_s"], call["duration_s"])
+    for kind, count in session["errors"].items():
+        summary["errors"][kind] = summary["errors"].get(kind, 0) + count
+    delay = session["postponed_s"] if session["postponed_s"] is not None else session["delay_s"]
+    if delay is not None:
+        summary["delays_s"][str(delay)] = summary["delays_s"].get(str(delay), 0) + 1
+    summary["slowest_sessions"].append((session["duration_s"], session["session"], session["started_at"].isoformat()))
+    summary["slowest_sessions"] = sorted(summary["slowest_sessions"], reverse=True)[:slowest]
+
+def finish_summary(summary):
+    for stats in summary["methods"].values():
+        stats["mean_s"] = stats["total_s"] / stats["count"]
+    summary["slowest_sessions"] = [
+        {"session": number, "started_at": started, "duration_s": duration}
+        for duration, number, started in summary["slowest_sessions"]
+    ]
+    return summary
+
+def session_row(session):
+    row = {field: session.get(field) for field in CSV_FIELDS}
+    row["started_at"] = session["started_at"].isoformat()
+    row["ended_at"] = session["ended_at"].isoformat()
+    row["calls"] = " ".join(f"{c['method']}:{c['duration_s']:g}" for c in session["calls"])
+    row["errors"] = " ".join(f"{k}:{v}" for k, v in session["errors"].items())
+    return row
+
+def session_json(session):
+    session = dict(session)
+    session["started_at"] = session["started_at"].isoformat()
+    session["ended_at"] = session["ended_at"].isoformat()
+    session["calls"] = [dict(c, started_at=c["started_at"].isoformat()) for c in session["calls"]]
+    return session
+
+# Analyze QWCLog files. CSV writes one row per session; JSON writes the
+# summary plus (optionally) every session timeline.
+def analyze(paths, output=None, fmt="json", include_sessions=True):
+    summary = new_summary()
+    out = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == "csv":
+            writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for session in iter_sessions(paths):
+                add_to_summary(summary, session)
+                writer.writerow(session_row(session))
+            return finish_summary(summary)
+        sessions = []
+        for session in iter_sessions(paths):
+            add_to_summary(summary, session)
+            if include_sessions:
+                sessions.append(session_json(session))
+        report = {"files": list(paths), "summary": finish_summary(summary)}
+        if include_sessions:
+            report["sessions"] = sessions
+        json.dump(report, out, indent=2)
+        out.write("\n")
+        return report["summary"]
+    finally:
+        if output:
+            out.close()
+
+def main():
+    patterns = sys.argv[1:] or ["logs/QWCLog*.txt"]
+    paths = [path for pattern in patterns for path in sorted(glob.glob(pattern))]
+    if not paths:
+        print(f"No QWCLog files matched {patterns}")
+        sys.exit(1)
+    analyze(paths, include_sessions=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import sys
+import json
+import time
+import sync
+from fingerprints import RECONCILE_BUCKETS, bucket_digests, bucket_of, check_buckets, contact_fingerprint
+
+# Bucketed reconciliation between QuickBooks, the mapping store and Filevine.
+#
+# Records are partitioned into hash buckets by Filevine id. The mapping
+# store gives the expected (id, fingerprint) pairs locally and the mock
+# server's /core/digest endpoint gives the actual ones, so only buckets
+# whose digests differ are downloaded and diffed. The server only digests
+# records the sync created (stored with an Idempotency-Key or a sourceId),
+# so contacts entered by hand in Filevine never make a bucket differ. The
+# result is a repair plan written to reconcile_plan_<timestamp>.json;
+# nothing is modified.
+
+def fetch_digest(collection, headers, buckets):
+    response = sync.filevine_session.get(
+        f"{sync.FILEVINE_API}/core/digest/{collection}", params={"buckets": buckets}, headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+def fetch_bucket(path, bucket, buckets, headers):
+    response = sync.filevine_session.get(
+        f"{sync.FILEVINE_API}{path}", params={"bucket": bucket, "buckets": buckets}, headers=headers
+    )
+    response.raise_for_status()
+    body = response.json()
+    return body.get("data", []) if isinstance(body, dict) else body
+
+# One record by id (e.g. {"personId": ...}), or None if Filevine no longer has it
+def fetch_record(path, params, headers):
+    response = sync.filevine_session.get(f"{sync.FILEVINE_API}{path}", params=params, headers=headers)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    body = response.json()
+    return body[0] if isinstance(body, list) and body else None
+
+# Buckets whose local and remote digests disagree
+def differing_buckets(local_pairs, remote, buckets):
+    local_digests, _ = bucket_digests(local_pairs, buckets)
+    return [i for i in range(buckets) if local_digests[i] != remote["digests"][i]]
+
+# Group mapped ids by bucket once, so each differing bucket is diffed in O(bucket size)
+def group_by_bucket(ids, buckets):
+    grouped = {}
+    for record_id in ids:
+        grouped.setdefault(bucket_of(record_id, buckets), []).append(record_id)
+    return grouped
+
+def reconcile_contacts(headers, buckets):
+    fingerprints = sync.qbd_to_filevine["fingerprints"]["customers"]
+    mapped = {
+        person_id: (qbd_id, fingerprints.get(qbd_id, {}).get("filevine"))
+        for qbd_id, person_id in sync.qbd_to_filevine["customers"].items()
+    }
+    remote = fetch_digest("contacts", headers, buckets)
+    differing = differing_buckets(((pid, fp) for pid, (_, fp) in mapped.items()), remote, buckets)
+    print(f"Contacts: {len(differing)} of {buckets} buckets differ")
+
+    actions = []
+    mapped_by_bucket = group_by_bucket(mapped, buckets)
+    for bucket in differing:
+        found = {c["personId"]: c for c in fetch_bucket("/core/contacts", bucket, buckets, headers)}
+        for person_id in mapped_by_bucket.get(bucket, []):
+            qbd_id, fingerprint = mapped[person_id]
+            contact = found.pop(person_id, None)
+            if contact is None:
+                # Contacts created before the sync marked its records are not
+                # in the bucket; confirm those one by one before recreating
+                contact = fetch_record("/core/contacts", {"personId": person_id}, headers)
+                if contact is None:
+                    actions.append({"action": "recreate_contact", "qbdId": qbd_id, "personId": person_id,
+                                    "reason": "mapped contact missing in Filevine"})
+                    continue
+                actions.append({"action": "link_contact", "qbdId": qbd_id, "personId": person_id,
+                                "reason": "mapped contact has no sourceId yet; the next sync links it"})
+            if fingerprint is None:
+                actions.append({"action": "refresh_fingerprint", "qbdId": qbd_id, "personId": person_id,
+                                "reason": "mapping has no stored fingerprint"})
+            elif contact_fingerprint(contact) != fingerprint:
+                actions.append({"action": "resync_contact", "qbdId": qbd_id, "personId": person_id,
+                                "fullName": contact.get("fullName"),
+                                "reason": "Filevine contact differs from last synced state"})
+        for person_id, contact in found.items():
+            actions.append({"action": "review_unmapped_contact", "personId": person_id,
+                            "fullName": contact.get("fullName"), "reason": "Filevine contact has no QBD mapping"})
+
+    # The digest endpoint reports name collisions among sync-created contacts,
+    # so duplicates never need a full download
+    # Deletes are only proposed when a mapped copy survives; otherwise a
+    # person has to pick which copy is the real one
+    for duplicate in remote.get("duplicates", []):
+        keep = [pid for pid in duplicate["ids"] if pid in mapped]
+        if not keep:
+            actions.append({"action": "review_duplicate_contact", "personIds": duplicate["ids"],
+                            "fullName": duplicate["fullName"],
+                            "reason": "duplicate contact name and no copy is mapped"})
+            continue
+        for person_id in duplicate["ids"]:
+            if person_id not in keep:
+                actions.append({"action": "delete_duplicate_contact", "personId": person_id,
+                                "fullName": duplicate["fullName"], "keep": keep,
+                                "reason": "duplicate contact name"})
+    return differing, actions
+
+def reconcile_expenses(headers, buckets):
+    mapped = {expense_id: key for key, expense_id in sync.qbd_to_filevine["expenses"].items()}
+    remote = fetch_digest("expenses", headers, buckets)
+    differing = differing_buckets(((eid, "") for eid in mapped), remote, buckets)
+    print(f"Expenses: {len(differing)} of {buckets} buckets differ")
+
+    actions = []
+    unsourced = 0
+    mapped_by_bucket = group_by_bucket(mapped, buckets)
+    for bucket in differing:
+        found = {e["expenseId"] for e in fetch_bucket("/core/expense", bucket, buckets, headers)}
+        for expense_id in mapped_by_bucket.get(bucket, []):
+            if expense_id in found:
+                found.discard(expense_id)
+            elif fetch_record("/core/expense", {"expenseId": expense_id}, headers) is not None:
+                # Created before Idempotency-Key existed, so not in the bucket
+                unsourced += 1
+            else:
+                actions.append({"action": "recreate_expense", "expenseKey": mapped[expense_id], "expenseId": expense_id,
+                                "reason": "mapped expense missing in Filevine"})
+        for expense_id in found:
+            actions.append({"action": "review_unmapped_expense", "expenseId": expense_id,
+                            "reason": "Filevine expense has no QBD mapping"})
+    if unsourced:
+        print(f"Expenses: {unsourced} mapped expenses predate idempotency keys and were checked one by one")
+    return differing, actions
+
+# QBD side: mapped customers that no longer exist, and customers or expense
+# lines that were never synced. This needs full QBD lists, so it is opt-in.
+def reconcile_qbd():
+    actions = []
+    customers = sync.fetch_qbd_customers()
+    if customers is not None:
+        qbd_ids = {getattr(c, 'id', None) for c in customers}
+        for qbd_id, person_id in sync.qbd_to_filevine["customers"].items():
+            if qbd_id not in qbd_ids:
+                actions.append({"action": "remove_mapping", "qbdId": qbd_id, "personId": person_id,
+                                "reason": "mapped QBD customer no longer exists"})
+        for customer in customers:
+            if customer.id not in sync.qbd_to_filevine["customers"]:
+                actions.append({"action": "create_contact", "qbdId": customer.id, "fullName": customer.full_name,
+                                "reason": "QBD customer was never synced"})
+    try:
+        invoices = sync.list_qbd(sync.get_conductor().qbd.invoices)
+    except Exception as e:
+        print(f"Failed to fetch invoices: {e}")
+        return actions
+    for invoice in invoices:
+        for line, expense_key in sync.expense_lines(invoice):
+            if expense_key not in sync.qbd_to_filevine["expenses"]:
+                actions.append({"action": "create_expense", "expenseKey": expense_key,
+                                "description": getattr(line, 'description', None),
+                                "reason": "QBD expense line was never synced"})
+    return actions
+
+def reconcile(include_qbd=False, buckets=RECONCILE_BUCKETS):
+    check_buckets(buckets)
+    print(f"Starting reconciliation at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    sync.load_mappings()
+    headers = sync.filevine_headers()
+    contact_buckets, contact_actions = reconcile_contacts(headers, buckets)
+    expense_buckets, expense_actions = reconcile_expenses(headers, buckets)
+    actions = contact_actions + expense_actions
+    if include_qbd:
+        actions += reconcile_qbd()
+
+    plan = {
+        "generated_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "buckets": buckets,
+        "differing_buckets": {"contacts": contact_buckets, "expenses": expense_buckets},
+        "actions": actions
+    }
+    plan_file = f"reconcile_plan_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(plan_file, "w") as f:
+        json.dump(plan, f, indent=2)
+    summary = {}
+    for action in actions:
+        summary[action["action"]] = summary.get(action["action"], 0) + 1
+    print(f"Reconciliation found {len(actions)} issues: {summary or 'none'}")
+    print(f"Repair plan written to {plan_file}")
+    return plan
+
+def main():
+    reconcile(include_qbd="--qbd" in sys.argv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import sys
+import time
+import sync
+import dead_letters
+
+# Replay the dead-letter queue.
+#
+# Only the failed records are re-sent, REPLAY_BATCH_SIZE at a time, through
+# the same create functions (and idempotency keys) as a normal sync, so a
+# record that did land before its error was reported is not duplicated.
+# A batch whose records keep failing is retried with exponential backoff;
+# if every record of a batch is still failing after the last retry the
+# target is assumed to be down and the replay stops.
+
+REPLAY_BATCH_SIZE = 50
+REPLAY_RETRIES = 3
+REPLAY_BACKOFF = 2.0  # seconds, doubled on every retry
+
+def send_customers(rows, headers):
+    jobs = [(key, body["payload"], body["fingerprint"], headers) for key, body in rows]
+    sync.run_writes(sync.create_customer, jobs)
+
+def send_expenses(rows, headers):
+    sync.run_writes(sync.create_expense, [(key, body, headers) for key, body in rows])
+
+def send_billing(kind):
+    def send(rows, headers):
+        for start in range(0, len(rows), sync.BILLING_BATCH_SIZE):
+            sync.post_billing_batch(kind, rows[start:start + sync.BILLING_BATCH_SIZE], headers)
+    return send
+
+# Mapping kind -> function that re-sends a list of (key, payload) rows
+SENDERS = {
+    "customers": send_customers,
+    "expenses": send_expenses,
+    "invoices": send_billing("invoices"),
+    "time_entries": send_billing("time_entries")
+}
+
+# Re-send one batch until it lands or the retries run out; returns the
+# keys that are still failing
+def replay_batch(kind, rows, headers, retries, backoff):
+    mapping = sync.qbd_to_filevine[kind]
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"Retrying {len(rows)} {kind} in {delay:.1f}s (attempt {attempt + 1} of {retries + 1})")
+            time.sleep(delay)
+        SENDERS[kind](rows, headers)
+        landed = [key for key, _ in rows if key in mapping]
+        dead_letters.resolve(kind, landed)
+        rows = [(key, body) for key, body in rows if key not in mapping]
+        if not rows:
+            break
+    return [key for key, _ in rows]
+
+def replay(kinds=None, batch_size=REPLAY_BATCH_SIZE, max_attempts=None,
+           retries=REPLAY_RETRIES, backoff=REPLAY_BACKOFF):
+    print(f"Starting dead-letter replay at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    queued = dead_letters.summary()
+    if not queued:
+        print("Dead-letter queue is empty")
+        return {}
+    print(f"Queued: {queued}")
+    sync.load_mappings()
+    headers = sync.filevine_headers()
+    totals = {}
+    aborted = False
+    for kind in kinds or SENDERS:
+        if aborted:
+            break
+        if kind not in queued:
+            continue
+        counts = {"resent": 0, "already synced": 0, "still failing": 0}
+        after = 0
+        while not aborted:
+            rows = dead_letters.pending(kind, after, batch_size, max_attempts)
+            if not rows:
+                break
+            after = rows[-1][0]
+            # Records a later full sync already created only need their row dropped
+            synced = [key for _, key, _, _ in rows if key in sync.qbd_to_filevine[kind]]
+            dead_letters.resolve(kind, synced)
+            counts["already synced"] += len(synced)
+            batch = [(key, body) for _, key, body, _ in rows if key not in sync.qbd_to_filevine[kind]]
+            if not batch:
+                continue
+            failing = replay_batch(kind, batch, headers, retries, backoff)
+            counts["resent"] += len(batch) - len(failing)
+            counts["still failing"] += len(failing)
+            if len(failing) == len(batch):
+                print(f"Every {kind} record in the batch is still failing; stopping the replay")
+                aborted = True
+        totals[kind] = counts
+        print(f"Replayed {kind}: {counts}")
+    sync.save_mappings()
+    print(f"Remaining: {dead_letters.summary() or 'none'}")
+    return totals
+
+def main():
+    replay(kinds=sys.argv[1:] or None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+# Invoice and time-entry records shared by the FastAPI and Flask mock servers.
+#
+# Both servers accept single creates and batches of up to MAX_BATCH_SIZE
+# items; every batch item carries its own idempotency key so a retried
+# batch only creates the items that did not land the first time. Batch
+# updates carry the record id instead and overwrite the fields they send.
+
+MAX_BATCH_SIZE = 500
+
+INVOICE_FIELDS = ("projectId", "sourceId", "invoiceNumber", "invoiceDate", "dueDate",
+                  "memo", "subtotal", "total", "balance", "lines")
+TIME_ENTRY_FIELDS = ("projectId", "sourceId", "date", "hours", "description", "timekeeper",
+                     "serviceItem", "billable", "rate")
+
+# Fields a batch update may change, per collection
+UPDATE_FIELDS = {"invoices": INVOICE_FIELDS, "time_entries": TIME_ENTRY_FIELDS}
+
+
+def new_record(id_field: str, fields, data: Dict) -> Dict:
+    now = datetime.utcnow().isoformat()
+    record = {id_field: str(uuid.uuid4())}
+    record.update({field: data.get(field) for field in fields})
+    record["created_at"] = now
+    record["updated_at"] = now
+    return record
+
+
+def invoice_record(data: Dict) -> Dict:
+    record = new_record("invoiceId", INVOICE_FIELDS, data)
+    record["lines"] = record["lines"] or []
+    return record
+
+
+def time_entry_record(data: Dict) -> Dict:
+    return new_record("entryId", TIME_ENTRY_FIELDS, data)
+
+
+# Store a batch of create requests ({"idempotencyKey": ..., **fields}).
+# Items without a key are always created.
+def create_batch(storage, collection: str, id_field: str, build, items: List[Dict]) -> List[Dict]:
+    keyed = []
+    positions = []
+    results = []
+    for item in items:
+        record = build(item)
+        result = {id_field: record[id_field], "idempotencyKey": item.get("idempotencyKey")}
+        if item.get("idempotencyKey"):
+            keyed.append((record, result, item["idempotencyKey"]))
+            positions.append(len(results))
+            results.append(None)
+        else:
+            storage.insert(collection, record)
+            results.append({**result, "replayed": False})
+    for position, (result, created) in zip(positions, storage.insert_many_idempotent(collection, keyed)):
+        results[position] = {**result, "replayed": not created}
+    return results
+
+
+# Apply a batch of updates ({id_field: ..., **fields}); an item whose
+# record does not exist comes back with "updated": False
+def update_batch(storage, collection: str, id_field: str, items: List[Dict]) -> List[Dict]:
+    results = []
+    for item in items:
+        changes = {field: item[field] for field in UPDATE_FIELDS[collection] if field in item}
+        changes["updated_at"] = datetime.utcnow().isoformat()
+        updated = item.get(id_field) is not None and storage.update(collection, item[id_field], changes) is not None
+        results.append({id_field: item.get(id_field), "updated": updated})
+    return results
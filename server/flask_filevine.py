@@ -1,64 +1,43 @@
+import sys
 from datetime import datetime
-import json
-import os
 from flask import Flask, request, jsonify
 import uuid
 from pathlib import Path
 
+try:
+    from server.storage import open_storage
+    from server.billing import MAX_BATCH_SIZE, create_batch, invoice_record, time_entry_record, update_batch
+except ImportError:  # run directly as `python server/flask_filevine.py`
+    # storage.py hashes buckets with the repo root's fingerprints.py
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from storage import open_storage
+    from billing import MAX_BATCH_SIZE, create_batch, invoice_record, time_entry_record, update_batch
+
 app = Flask(__name__)
 
-# Initialize data lists
+# Persistent storage (SQLite by default, see storage.py)
 base_dir = Path(__file__).resolve().parent
 cache_dir = base_dir / 'cache'
-os.makedirs(cache_dir)
-
-contacts = []
-expenses = []
-invoices = []
-time_entries = []
-sync_status = []
-
-# Persistent storage
-# Persistent storage
-CONTACTS_FILE = cache_dir / "contacts.json"
-EXPENSES_FILE = cache_dir / "expenses.json"
-INVOICES_FILE = cache_dir / "invoices.json"
-TIME_ENTRIES_FILE = cache_dir / "time_entries.json"
-SYNC_STATUS_FILE = cache_dir / "sync_status.json"
-
-
-
-
-def load_data(file):
-    if os.path.exists(file):
-        with open(file, "r") as f:
-            return json.load(f)
-    return []
-
-def save_data(file, data):
-    with open(file, "w") as f:
-        json.dump(data, f, indent=2)
-
-# Load cached data on startup (optional)
-def load_cached_data():
-    global contacts, expenses, invoices, time_entries, sync_status
-    try:
-        for name, lst in [
-            ("contacts.json", contacts),
-            ("expenses.json", expenses),
-            ("invoices.json", invoices),
-            ("time_entries.json", time_entries),
-            ("sync_status.json", sync_status)
-        ]:
-            file_path = cache_dir / name
-            if file_path.exists():
-                with open(file_path, "r", encoding="utf-8") as f:
-                    lst.extend(json.load(f))
-                print(f"Loaded cached data from {file_path}")
-    except Exception as e:
-        print(f"Failed to load cached data: {e}")
-
-load_cached_data()
+COLLECTIONS = {
+    "contacts": "contactId",
+    "expenses": "expenseId",
+    "invoices": "invoiceId",
+    "time_entries": "entryId",
+    "sync_status": None
+}
+storage = open_storage(cache_dir, COLLECTIONS)
+
+# Store a created record, or return the original result when the client
+# replays an Idempotency-Key it already used for this collection
+def create_record(collection, record, result):
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if not idempotency_key:
+        storage.insert(collection, record)
+        return jsonify(result), 201
+    stored, created = storage.insert_idempotent(collection, record, result, idempotency_key)
+    if not created:
+        return jsonify(stored), 200, {"Idempotent-Replayed": "true"}
+    return jsonify(stored), 201
 
 # Token endpoint
 @app.route("/connect/token", methods=["POST"])
@@ -75,8 +54,8 @@ def index():
         "endpoints": {
             "/core/contacts": "Manage contacts (GET, POST)",
             "/core/expense": "Manage expenses (GET, POST)",
-            "/core/invoice": "Manage invoices (GET, POST)",
-            "/core/time": "Manage time entries (GET, POST)",
+            "/core/invoice": "Manage invoices (GET, POST; POST /core/invoice/batch)",
+            "/core/time": "Manage time entries (GET, POST; POST /core/time/batch)",
             "/connect/token": "Mock authentication (POST)",
             "/fv-app/v2/AccountingSync": "Sync billing items (PUT)"
         }
@@ -85,15 +64,14 @@ def index():
 # Contacts endpoints
 @app.route("/core/contacts", methods=["GET", "POST"])
 def handle_contacts():
-    contacts = load_data(CONTACTS_FILE)
     if request.method == "GET":
         contact_id = request.args.get("contactId")
         if contact_id:
-            for contact in contacts:
-                if contact["contactId"] == contact_id:
-                    return jsonify(contact)
+            contact = storage.get("contacts", contact_id)
+            if contact is not None:
+                return jsonify(contact)
             return jsonify({"error": "Contact not found"}), 404
-        return jsonify(contacts)
+        return jsonify(storage.all("contacts"))
     elif request.method == "POST":
         data = request.json
         contact_id = data.get("contactId", str(uuid.uuid4()))
@@ -103,34 +81,29 @@ def handle_contacts():
             "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat()
         }
-        contacts.append(contact)
-        save_data(CONTACTS_FILE, contacts)
-        return jsonify({"contactId": contact_id}), 201
+        return create_record("contacts", contact, {"contactId": contact_id})
 
 @app.route("/core/contacts/<contact_id>", methods=["PATCH"])
 def update_contact(contact_id):
     data = request.json
-    contacts = load_data(CONTACTS_FILE)
-    for contact in contacts:
-        if contact["contactId"] == contact_id:
-            contact["full_name"] = data.get("full_name", contact["full_name"])
-            contact["updated_at"] = datetime.utcnow().isoformat()
-            save_data(CONTACTS_FILE, contacts)
-            return jsonify({"contactId": contact_id})
+    changes = {"updated_at": datetime.utcnow().isoformat()}
+    if "full_name" in data:
+        changes["full_name"] = data["full_name"]
+    if storage.update("contacts", contact_id, changes) is not None:
+        return jsonify({"contactId": contact_id})
     return jsonify({"error": "Contact not found"}), 404
 
 # Expense endpoints
 @app.route("/core/expense", methods=["GET", "POST", "PATCH", "DELETE"])
 def handle_expenses():
-    expenses = load_data(EXPENSES_FILE)
     if request.method == "GET":
         expense_id = request.args.get("expenseId")
         if expense_id:
-            for expense in expenses:
-                if expense["expenseId"] == expense_id:
-                    return jsonify(expense)
+            expense = storage.get("expenses", expense_id)
+            if expense is not None:
+                return jsonify(expense)
             return jsonify({"error": "Expense not found"}), 404
-        return jsonify(expenses)
+        return jsonify(storage.all("expenses"))
     elif request.method == "POST":
         data = request.json
         expense_id = str(uuid.uuid4())
@@ -144,34 +117,55 @@ def handle_expenses():
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat()
         }
-        expenses.append(expense)
-        save_data(EXPENSES_FILE, expenses)
-        return jsonify({"status": "success", "expenseId": expense_id}), 201
+        return create_record("expenses", expense, {"status": "success", "expenseId": expense_id})
     elif request.method == "PATCH":
         expense_id = request.args.get("expenseId")
         if not expense_id:
             return jsonify({"error": "expenseId query parameter required"}), 400
         data = request.json
-        for expense in expenses:
-            if expense["expenseId"] == expense_id:
-                expense["description"] = data.get("description", expense["description"])
-                expense["amount"] = data.get("amount", expense["amount"])
-                expense["date"] = data.get("date", expense["date"])
-                expense["category"] = data.get("category", expense["category"])
-                expense["updated_at"] = datetime.utcnow().isoformat()
-                save_data(EXPENSES_FILE, expenses)
-                return jsonify({"expenseId": expense_id})
+        changes = {field: data[field] for field in ("description", "amount", "date", "category") if field in data}
+        changes["updated_at"] = datetime.utcnow().isoformat()
+        if storage.update("expenses", expense_id, changes) is not None:
+            return jsonify({"expenseId": expense_id})
         return jsonify({"error": "Expense not found"}), 404
     elif request.method == "DELETE":
         expense_id = request.args.get("expenseId")
         if not expense_id:
             return jsonify({"error": "expenseId query parameter required"}), 400
-        for i, expense in enumerate(expenses):
-            if expense["expenseId"] == expense_id:
-                expenses.pop(i)
-                save_data(EXPENSES_FILE, expenses)
-                return jsonify({"status": "success"}), 200
+        if storage.delete("expenses", expense_id):
+            return jsonify({"status": "success"}), 200
         return jsonify({"error": "Expense not found"}), 404
-    
+
+# Invoice and time entry endpoints; records are built in billing.py
+BILLING = {
+    "invoice": ("invoices", "invoiceId", invoice_record),
+    "time": ("time_entries", "entryId", time_entry_record)
+}
+
+@app.route("/core/<kind>", methods=["GET", "POST"])
+def handle_billing(kind):
+    if kind not in BILLING:
+        return jsonify({"error": "Not found"}), 404
+    collection, id_field, build = BILLING[kind]
+    if request.method == "GET":
+        project_id = request.args.get("projectId")
+        if project_id:
+            return jsonify(storage.by_project(collection, project_id))
+        return jsonify(storage.all(collection))
+    record = build(request.json or {})
+    return create_record(collection, record, {id_field: record[id_field]})
+
+@app.route("/core/<kind>/batch", methods=["POST", "PATCH"])
+def handle_billing_batch(kind):
+    if kind not in BILLING:
+        return jsonify({"error": "Not found"}), 404
+    collection, id_field, build = BILLING[kind]
+    items = (request.json or {}).get("items", [])
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batches are limited to {MAX_BATCH_SIZE} items"}), 413
+    if request.method == "PATCH":
+        return jsonify({"results": update_batch(storage, collection, id_field, items)}), 200
+    return jsonify({"results": create_batch(storage, collection, id_field, build, items)}), 200
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,481 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fingerprints import MAX_BUCKETS, bucket_of, stored_buckets
+
+# Storage backends shared by the FastAPI and Flask mock servers.
+#
+# Both backends expose the same collection API; records are plain dicts
+# keyed by the collection's id field (e.g. "personId" for contacts). The
+# SQLite backend is the default because it is safe to share between
+# multiple uvicorn workers; the JSON backend keeps the original
+# cache/*.json files as the source of truth.
+#
+# Records the sync created are "sourced": they carry a sourceId or were
+# stored under an Idempotency-Key. Reconciliation digests only cover
+# sourced records, so contacts entered by hand in Filevine never make a
+# bucket differ.
+
+STORAGE_BACKEND = os.environ.get("FILEVINE_STORAGE", "sqlite")
+DB_NAME = "filevine.db"
+
+
+def encode_record(record: Dict) -> str:
+    return json.dumps(record, separators=(",", ":"))
+
+
+class JsonStorage:
+    def __init__(self, cache_dir: Path, collections: Dict[str, Optional[str]]):
+        self.cache_dir = cache_dir
+        self.collections = collections
+        self.lock = threading.Lock()
+
+    def _file(self, name: str) -> Path:
+        return self.cache_dir / f"{name}.json"
+
+    def _load(self, name: str) -> List[Dict]:
+        file = self._file(name)
+        if not file.exists() or file.stat().st_size == 0:
+            return []
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error in {file.name}: {e}")
+            return []
+
+    def _save(self, name: str, records: List[Dict]):
+        # Write to a temp file first so readers never see a half-written list
+        file = self._file(name)
+        tmp = file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp, file)
+
+    def all(self, name: str) -> List[Dict]:
+        return self._load(name)
+
+    def get(self, name: str, record_id: str) -> Optional[Dict]:
+        key = self.collections[name]
+        for record in self._load(name):
+            if record.get(key) == record_id:
+                return record
+        return None
+
+    def changed_since(self, name: str, updated_at: str) -> List[Dict]:
+        return [r for r in self._load(name) if (r.get("updated_at") or "") > updated_at]
+
+    def by_project(self, name: str, project_id: str) -> List[Dict]:
+        return [r for r in self._load(name) if r.get("projectId") == project_id]
+
+    # Ids of the records stored under an idempotency key
+    def _keyed_ids(self, name: str) -> set:
+        key = self.collections[name]
+        prefix = f"{name}:"
+        return {entry["result"].get(key) for entry in self._load("idempotency_keys") if entry["key"].startswith(prefix)}
+
+    def sourced(self, name: str) -> List[Dict]:
+        key = self.collections[name]
+        keyed = self._keyed_ids(name)
+        return [r for r in self._load(name) if r.get(key) and (r.get("sourceId") or r[key] in keyed)]
+
+    def sourced_in_bucket(self, name: str, bucket: int, buckets: int) -> List[Dict]:
+        key = self.collections[name]
+        return [r for r in self.sourced(name) if bucket_of(r[key], buckets) == bucket]
+
+    # Groups of sourced record ids sharing the same value of field
+    def duplicates(self, name: str, field: str) -> List[Tuple[str, List[str]]]:
+        key = self.collections[name]
+        grouped = {}
+        for record in self.sourced(name):
+            grouped.setdefault(record.get(field), []).append(record.get(key))
+        return [(value, ids) for value, ids in grouped.items() if len(ids) > 1]
+
+    def insert(self, name: str, record: Dict) -> Dict:
+        with self.lock:
+            records = self._load(name)
+            records.append(record)
+            self._save(name, records)
+        return record
+
+    # Keys whose record was deleted are released, so the same key creates
+    # the record again instead of replaying a dead id
+    def _live_keys(self, name: str, keys: List[Dict], records: List[Dict]) -> List[Dict]:
+        key = self.collections[name]
+        prefix = f"{name}:"
+        ids = {record.get(key) for record in records}
+        return [entry for entry in keys
+                if not entry["key"].startswith(prefix) or not key or entry["result"].get(key) in ids]
+
+    # Insert once per idempotency key; a replay returns the original result
+    def insert_idempotent(self, name: str, record: Dict, result: Dict, idempotency_key: str) -> Tuple[Dict, bool]:
+        scoped_key = f"{name}:{idempotency_key}"
+        with self.lock:
+            records = self._load(name)
+            keys = self._live_keys(name, self._load("idempotency_keys"), records)
+            index = {entry["key"]: entry["result"] for entry in keys}
+            if scoped_key in index:
+                return index[scoped_key], False
+            records.append(record)
+            self._save(name, records)
+            keys.append({"key": scoped_key, "result": result})
+            self._save("idempotency_keys", keys)
+        return result, True
+
+    # Batch form of insert_idempotent: one load and one save per batch
+    def insert_many_idempotent(self, name: str, items: List[Tuple[Dict, Dict, str]]) -> List[Tuple[Dict, bool]]:
+        results = []
+        with self.lock:
+            records = self._load(name)
+            keys = self._live_keys(name, self._load("idempotency_keys"), records)
+            index = {entry["key"]: entry["result"] for entry in keys}
+            for record, result, idempotency_key in items:
+                scoped_key = f"{name}:{idempotency_key}"
+                if scoped_key in index:
+                    results.append((index[scoped_key], False))
+                    continue
+                records.append(record)
+                keys.append({"key": scoped_key, "result": result})
+                index[scoped_key] = result
+                results.append((result, True))
+            self._save(name, records)
+            self._save("idempotency_keys", keys)
+        return results
+
+    def update(self, name: str, record_id: str, changes: Dict) -> Optional[Dict]:
+        key = self.collections[name]
+        with self.lock:
+            records = self._load(name)
+            for record in records:
+                if record.get(key) == record_id:
+                    record.update(changes)
+                    self._save(name, records)
+                    return record
+        return None
+
+    def delete(self, name: str, record_id: str) -> bool:
+        key = self.collections[name]
+        with self.lock:
+            records = self._load(name)
+            for i, record in enumerate(records):
+                if record.get(key) == record_id:
+                    records.pop(i)
+                    self._save(name, records)
+                    keys = self._load("idempotency_keys")
+                    live = self._live_keys(name, keys, records)
+                    if len(live) != len(keys):
+                        self._save("idempotency_keys", live)
+                    return True
+        return False
+
+    def version(self, name: str) -> Tuple[str, float]:
+        # The file's mtime and size change on every save, across all workers
+        try:
+            stat = self._file(name).stat()
+        except FileNotFoundError:
+            return "0", 0
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}", stat.st_mtime
+
+    def dump(self, name: str) -> bytes:
+        return json.dumps(self._load(name), separators=(",", ":")).encode("utf-8")
+
+
+class SQLiteStorage:
+    def __init__(self, db_path: Path, collections: Dict[str, Optional[str]], seed_dir: Optional[Path] = None):
+        self.db_path = db_path
+        self.collections = collections
+        self.local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                updated_at TEXT,
+                source TEXT,
+                bucket INTEGER,
+                PRIMARY KEY (collection, id)
+            );
+            CREATE INDEX IF NOT EXISTS records_updated_at ON records (collection, updated_at);
+            CREATE INDEX IF NOT EXISTS records_project ON records (collection, json_extract(body, '$.projectId'));
+            CREATE TABLE IF NOT EXISTS versions (
+                collection TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                modified REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (collection, key)
+            );
+        """)
+        self._migrate()
+        conn.execute("CREATE INDEX IF NOT EXISTS records_bucket ON records (collection, bucket) WHERE source IS NOT NULL")
+        with self.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('instance', ?)", (uuid.uuid4().hex[:8],))
+        self.instance = conn.execute("SELECT value FROM meta WHERE name = 'instance'").fetchone()[0]
+        if seed_dir is not None:
+            self._seed(seed_dir)
+
+    # One connection per thread; WAL lets readers proceed while a writer commits
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Databases created before records had source/bucket columns get them
+    # added and backfilled: the bucket from the id, the source from the
+    # body's sourceId or the idempotency key the record was stored under
+    def _migrate(self):
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+        if "source" in columns and "bucket" in columns:
+            return
+        with self.transaction() as conn:
+            # Another process may have migrated while we waited for the lock
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+            if "source" in columns and "bucket" in columns:
+                return
+            for column, kind in (("source", "TEXT"), ("bucket", "INTEGER")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE records ADD COLUMN {column} {kind}")
+            rows = conn.execute("SELECT collection, id FROM records").fetchall()
+            conn.executemany(
+                "UPDATE records SET bucket = ? WHERE collection = ? AND id = ?",
+                ((bucket_of(record_id, MAX_BUCKETS), name, record_id) for name, record_id in rows)
+            )
+            conn.execute("UPDATE records SET source = json_extract(body, '$.sourceId') WHERE source IS NULL")
+            for name, key, result in conn.execute("SELECT collection, key, result FROM idempotency_keys").fetchall():
+                record_id = json.loads(result).get(self.collections.get(name) or "")
+                if record_id:
+                    conn.execute(
+                        "UPDATE records SET source = ? WHERE collection = ? AND id = ? AND source IS NULL",
+                        (key, name, record_id)
+                    )
+        print(f"Added source and bucket columns to {len(rows)} records in {self.db_path}")
+
+    # Import the legacy cache/*.json files the first time a collection is opened
+    def _seed(self, seed_dir: Path):
+        with self.transaction() as conn:
+            for name in self.collections:
+                if conn.execute("SELECT 1 FROM versions WHERE collection = ?", (name,)).fetchone():
+                    continue
+                records = JsonStorage(seed_dir, self.collections).all(name)
+                for record in records:
+                    self._upsert(conn, name, record)
+                self._bump(conn, name)
+                if records:
+                    print(f"Imported {len(records)} {name} records from {seed_dir / (name + '.json')}")
+
+    def _record_id(self, name: str, record: Dict) -> str:
+        key = self.collections[name]
+        return record.get(key) if key else None
+
+    # An update never clears the source a record was created with
+    def _upsert(self, conn: sqlite3.Connection, name: str, record: Dict, source: Optional[str] = None):
+        record_id = self._record_id(name, record) or str(uuid.uuid4())
+        conn.execute(
+            "INSERT INTO records (collection, id, body, updated_at, source, bucket) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (collection, id) DO UPDATE SET body = excluded.body, updated_at = excluded.updated_at, "
+            "source = COALESCE(excluded.source, records.source)",
+            (name, record_id, encode_record(record), record.get("updated_at"),
+             record.get("sourceId") or source, bucket_of(record_id, MAX_BUCKETS))
+        )
+
+    def _bump(self, conn: sqlite3.Connection, name: str):
+        conn.execute(
+            "INSERT INTO versions (collection, version, modified) VALUES (?, 1, strftime('%s', 'now')) "
+            "ON CONFLICT (collection) DO UPDATE SET version = version + 1, modified = excluded.modified",
+            (name,)
+        )
+
+    def all(self, name: str) -> List[Dict]:
+        rows = self._conn().execute("SELECT body FROM records WHERE collection = ? ORDER BY rowid", (name,))
+        return [json.loads(body) for body, in rows]
+
+    def get(self, name: str, record_id: str) -> Optional[Dict]:
+        row = self._conn().execute(
+            "SELECT body FROM records WHERE collection = ? AND id = ?", (name, record_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def changed_since(self, name: str, updated_at: str) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT body FROM records WHERE collection = ? AND updated_at > ? ORDER BY updated_at",
+            (name, updated_at)
+        )
+        return [json.loads(body) for body, in rows]
+
+    # Served from the records_project expression index
+    def by_project(self, name: str, project_id: str) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT body FROM records WHERE collection = ? AND json_extract(body, '$.projectId') = ? ORDER BY rowid",
+            (name, project_id)
+        )
+        return [json.loads(body) for body, in rows]
+
+    def sourced(self, name: str) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT body FROM records WHERE collection = ? AND source IS NOT NULL ORDER BY rowid", (name,)
+        )
+        return [json.loads(body) for body, in rows]
+
+    # Bucket b of n is stored buckets b, b + n, ... of MAX_BUCKETS, all
+    # served from the records_bucket index
+    def sourced_in_bucket(self, name: str, bucket: int, buckets: int) -> List[Dict]:
+        stored = stored_buckets(bucket, buckets)
+        rows = self._conn().execute(
+            f"SELECT body FROM records WHERE collection = ? AND source IS NOT NULL "
+            f"AND bucket IN ({','.join('?' * len(stored))}) ORDER BY rowid",
+            (name, *stored)
+        )
+        return [json.loads(body) for body, in rows]
+
+    # Only sourced records: a hand-entered contact that shares a name with a
+    # synced one is not a duplicate the sync should clean up
+    def duplicates(self, name: str, field: str) -> List[Tuple[str, List[str]]]:
+        rows = self._conn().execute(
+            "SELECT value, json_group_array(id) FROM ("
+            "SELECT json_extract(body, ?) AS value, id FROM records "
+            "WHERE collection = ? AND source IS NOT NULL ORDER BY rowid"
+            ") GROUP BY value HAVING COUNT(*) > 1",
+            (f"$.{field}", name)
+        )
+        return [(value, json.loads(ids)) for value, ids in rows]
+
+    def insert(self, name: str, record: Dict) -> Dict:
+        with self.transaction() as conn:
+            self._upsert(conn, name, record)
+            self._bump(conn, name)
+        return record
+
+    # Stored result for a key, or None. A key whose record no longer exists
+    # is released, so the same key creates the record again instead of
+    # replaying a dead id.
+    def _replay(self, conn: sqlite3.Connection, name: str, idempotency_key: str) -> Optional[Dict]:
+        row = conn.execute(
+            "SELECT result FROM idempotency_keys WHERE collection = ? AND key = ?", (name, idempotency_key)
+        ).fetchone()
+        if row is None:
+            return None
+        result = json.loads(row[0])
+        record_id = result.get(self.collections.get(name) or "")
+        if record_id is None or conn.execute(
+            "SELECT 1 FROM records WHERE collection = ? AND id = ?", (name, record_id)
+        ).fetchone():
+            return result
+        conn.execute("DELETE FROM idempotency_keys WHERE collection = ? AND key = ?", (name, idempotency_key))
+        return None
+
+    # The key lookup and the insert share one write transaction, so
+    # concurrent requests with the same key create exactly one record
+    def insert_idempotent(self, name: str, record: Dict, result: Dict, idempotency_key: str) -> Tuple[Dict, bool]:
+        with self.transaction() as conn:
+            replayed = self._replay(conn, name, idempotency_key)
+            if replayed is not None:
+                return replayed, False
+            self._upsert(conn, name, record, source=idempotency_key)
+            self._bump(conn, name)
+            conn.execute(
+                "INSERT INTO idempotency_keys (collection, key, result) VALUES (?, ?, ?)",
+                (name, idempotency_key, encode_record(result))
+            )
+        return result, True
+
+    # A whole batch in one write transaction; keys repeated within the
+    # batch are replays of the first occurrence
+    def insert_many_idempotent(self, name: str, items: List[Tuple[Dict, Dict, str]]) -> List[Tuple[Dict, bool]]:
+        results = []
+        with self.transaction() as conn:
+            for record, result, idempotency_key in items:
+                replayed = self._replay(conn, name, idempotency_key)
+                if replayed is not None:
+                    results.append((replayed, False))
+                    continue
+                self._upsert(conn, name, record, source=idempotency_key)
+                conn.execute(
+                    "INSERT INTO idempotency_keys (collection, key, result) VALUES (?, ?, ?)",
+                    (name, idempotency_key, encode_record(result))
+                )
+                results.append((result, True))
+            if any(created for _, created in results):
+                self._bump(conn, name)
+        return results
+
+    def update(self, name: str, record_id: str, changes: Dict) -> Optional[Dict]:
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT body FROM records WHERE collection = ? AND id = ?", (name, record_id)
+            ).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            record.update(changes)
+            self._upsert(conn, name, record)
+            self._bump(conn, name)
+        return record
+
+    def delete(self, name: str, record_id: str) -> bool:
+        with self.transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM records WHERE collection = ? AND id = ?", (name, record_id)
+            ).rowcount
+            if deleted:
+                self._bump(conn, name)
+                if self.collections.get(name):
+                    conn.execute(
+                        "DELETE FROM idempotency_keys WHERE collection = ? AND json_extract(result, ?) = ?",
+                        (name, f"$.{self.collections[name]}", record_id)
+                    )
+        return bool(deleted)
+
+    def version(self, name: str) -> Tuple[str, float]:
+        row = self._conn().execute(
+            "SELECT version, modified FROM versions WHERE collection = ?", (name,)
+        ).fetchone()
+        version, modified = row if row else (0, 0)
+        return f"{self.instance}-{version:x}", modified
+
+    # Stored bodies are already compact JSON, so a list response is a join
+    def dump(self, name: str) -> bytes:
+        rows = self._conn().execute("SELECT body FROM records WHERE collection = ? ORDER BY rowid", (name,))
+        return b"[" + b",".join(body.encode("utf-8") for body, in rows) + b"]"
+
+
+def open_storage(cache_dir: Path, collections: Dict[str, Optional[str]], backend: str = STORAGE_BACKEND):
+    cache_dir.mkdir(exist_ok=True)
+    if backend == "json":
+        print(f"Using JSON storage in {cache_dir}")
+        return JsonStorage(cache_dir, collections)
+    if backend == "sqlite":
+        print(f"Using SQLite storage at {cache_dir / DB_NAME}")
+        return SQLiteStorage(cache_dir / DB_NAME, collections, seed_dir=cache_dir)
+    raise ValueError(f"Unknown FILEVINE_STORAGE backend: {backend}")
@@ -1,18 +1,28 @@
 import os
+import re
 import uuid
 import json
 import time
+import asyncio
 import schedule
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import glob
-from conductor import Conductor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from conductor import AsyncConductor, Conductor
 from dotenv import load_dotenv
+from fingerprints import CONTACT_LINK_FIELDS, contact_fingerprint
+import qbd_cache
+import dead_letters
+from hierarchy import build_customer_index
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Conductor
-conductor = Conductor(api_key=os.environ.get("CONDUCTOR_SECRET_KEY"))
+# Conductor client, created on first use so offline commands need no API key
+conductor = None
 
 # Mock Filevine API base URL
 FILEVINE_API = "http://localhost:5000"
@@ -23,13 +33,61 @@ END_USER_ID = "end_usr_Wb4uG5P0SbiOmD"
 # Config: Sync ItemLine entries as expenses?
 SYNC_ITEM_LINES = False  # Set to True for ItemLine (e.g., Painting), False for ExpenseLine
 
+# Config: Number of concurrent QuickBooks updates sent through Conductor per batch
+QBD_BATCH_SIZE = 10
+
+# Config: Number of Filevine writes (POST/PATCH) in flight at once
+CONCURRENCY = 1
+
+# Config: Page size for Conductor list calls (None uses Conductor's default)
+PAGE_SIZE = None
+
+# Config: Invoices or time entries per Filevine batch create
+BILLING_BATCH_SIZE = 100
+
+# Config: Print the writes a sync would make instead of sending them
+DRY_RUN = False
+
 # In-memory database for QBD-to-Filevine ID mappings
 qbd_to_filevine = {
     "customers": {},  # QBD id -> Filevine personId
     "accounts": {},   # QBD id -> Filevine category
-    "expenses": {}    # QBD id:LineID -> Filevine BillingItemId
+    "expenses": {},   # QBD id:LineID -> Filevine BillingItemId
+    "invoices": {},   # QBD invoice id -> Filevine invoiceId
+    "time_entries": {},  # QBD time tracking id -> Filevine entryId
+    "fingerprints": {
+        "customers": {}   # QBD id -> {"qbd": fingerprint, "filevine": fingerprint, "link": link fields}
+    },
+    "watermarks": {
+        "contacts": None,  # Highest Filevine contact updated_at already synced back to QBD
+        "invoices": None,  # updated_after for the next QBD invoice stream
+        "time_entries": None
+    },
+    "conflicts": {
+        "customers": {}   # QBD id -> details of a contact changed on both sides
+    },
+    "pending": {
+        "invoices": [],   # QBD ids deferred or failed last run, re-read by id on the next
+        "time_entries": []
+    }
 }
 
+# Shared HTTP session for Filevine. Creates carry an Idempotency-Key, so every
+# method (POST included) can be retried safely on transient failures.
+filevine_session = requests.Session()
+filevine_retries = HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None
+))
+filevine_session.mount("http://", filevine_retries)
+filevine_session.mount("https://", filevine_retries)
+
+# Last body and validator (ETag/Last-Modified) per Filevine collection URL,
+# so repeat GETs can be answered with 304 Not Modified. Only unfiltered
+# collections are cached; filtered URLs such as ?updatedSince= change every
+# run and would only grow the file.
+HTTP_CACHE_FILE = os.path.join("cache", "http_cache.json")
+http_cache = None
+
 # Load existing mappings from the latest mappings_*.json
 def load_mappings():
     mapping_files = glob.glob("mappings_*.json")
@@ -43,6 +101,52 @@ def load_mappings():
         except Exception as e:
             print(f"Failed to load mappings from {latest_file}: {e}")
 
+def load_http_cache():
+    global http_cache
+    if http_cache is None:
+        http_cache = {}
+        if os.path.exists(HTTP_CACHE_FILE):
+            try:
+                with open(HTTP_CACHE_FILE, "r", encoding="utf-8") as f:
+                    # Drop filtered URLs cached by earlier versions
+                    http_cache = {url: entry for url, entry in json.load(f).items() if "?" not in url}
+            except Exception as e:
+                print(f"Failed to load HTTP cache from {HTTP_CACHE_FILE}: {e}")
+    return http_cache
+
+def save_http_cache():
+    if http_cache is None:
+        return
+    os.makedirs(os.path.dirname(HTTP_CACHE_FILE), exist_ok=True)
+    with open(HTTP_CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(http_cache, f)
+
+# Conditional GET of a Filevine collection; reuses the cached body on 304.
+# Filtered requests (params) always go to the server uncached.
+def get_collection(path, headers, params=None):
+    url = requests.Request("GET", f"{FILEVINE_API}{path}", params=params).prepare().url
+    cache = {} if params else load_http_cache()
+    cached = cache.get(url)
+    request_headers = dict(headers)
+    if cached:
+        if cached.get("etag"):
+            request_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            request_headers["If-Modified-Since"] = cached["last_modified"]
+    response = filevine_session.get(url, headers=request_headers)
+    if response.status_code == 304 and cached:
+        return cached["body"]
+    response.raise_for_status()
+    body = response.json()
+    items = body.get("data", []) if isinstance(body, dict) else body
+    if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+        cache[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body": items
+        }
+    return items
+
 # Get Filevine token (mock)
 def get_filevine_token():
     try:
@@ -56,83 +160,377 @@ def get_filevine_token():
         print(f"Failed to get Filevine token: {e}")
         raise
 
-FILEVINE_TOKEN = get_filevine_token()
+FILEVINE_TOKEN = None
+
+# Authorization headers for Filevine; the token is fetched on first use
+def filevine_headers():
+    global FILEVINE_TOKEN
+    if FILEVINE_TOKEN is None:
+        FILEVINE_TOKEN = get_filevine_token()
+    return {"Authorization": f"Bearer {FILEVINE_TOKEN}"}
+
+def get_conductor():
+    global conductor
+    if conductor is None:
+        conductor = Conductor(api_key=os.environ.get("CONDUCTOR_SECRET_KEY"))
+    return conductor
 
-def check_customer_exists(qbd_id, full_name, headers):
+# Yield every record of a Conductor QBD resource, one cursor page at a time.
+# Unpaginated endpoints (e.g. accounts) take no limit parameter.
+def iter_qbd(resource, paginated=True, **params):
+    if PAGE_SIZE and paginated:
+        params["limit"] = PAGE_SIZE
+    page = resource.list(conductor_end_user_id=END_USER_ID, **params)
+    yield from page.data
+    while hasattr(page, "has_next_page") and page.has_next_page():
+        page = page.get_next_page()
+        yield from page.data
+
+def list_qbd(resource, paginated=True, **params):
+    return list(iter_qbd(resource, paginated, **params))
+
+# List a Conductor QBD entity through the local read-through cache
+def list_qbd_cached(entity, paginated=True, **params):
+    fetch = lambda **p: list_qbd(getattr(get_conductor().qbd, entity), paginated, **p)
+    return qbd_cache.read_through(END_USER_ID, entity, fetch, params)
+
+# Run write jobs (argument tuples for fn) with up to CONCURRENCY in flight
+def run_writes(fn, jobs):
+    if CONCURRENCY <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            fn(*job)
+        return
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        list(executor.map(lambda job: fn(*job), jobs))
+
+# Fetch all Filevine contacts once, indexed by personId
+def fetch_filevine_contacts(headers):
+    contacts = get_collection("/core/contacts", headers)
+    return {contact["personId"]: contact for contact in contacts if contact.get("personId")}
+
+# Fetch Filevine contacts changed after the given updated_at watermark
+def fetch_changed_filevine_contacts(since, headers):
+    params = {"updatedSince": since} if since else None
+    return get_collection("/core/contacts", headers, params)
+
+def fetch_qbd_customers():
     try:
-        response = requests.get(f"{FILEVINE_API}/core/contacts", headers=headers)
-        response.raise_for_status()
-        contacts = response.json().get("data", [])
-        for contact in contacts:
-            if contact.get("fullName") == full_name and qbd_to_filevine["customers"].get(qbd_id) == contact.get("personId"):
-                return contact["personId"]
-        return None
+        customers = list_qbd_cached("customers")
+        print(f"Fetched {len(customers)} customers from QuickBooks: {[c.full_name for c in customers]}")
+        if customers:
+            print("First customer attributes:", vars(customers[0]))
+        return customers
     except Exception as e:
-        print(f"Failed to check customer exists for {full_name}: {e}")
+        print(f"Failed to fetch customers: {e}")
         return None
 
-def check_expense_exists(expense_key, headers):
+# Filevine contact payload for a QBD customer
+def customer_payload(customer):
+    return {
+        "fullName": customer.full_name,
+        "email": getattr(customer, 'email', f"{customer.id}@example.com"),
+        "personTypes": ["Client"]
+    }
+
+# Fields that tie a Filevine contact back to its QBD customer: the QBD id
+# and, for a job, its parent's Filevine contact once the parent is mapped.
+# They are not part of the fingerprint; a change to them alone (a parent
+# created later, or a contact synced before links existed) is sent as a
+# link PATCH.
+def contact_link(customer_id, index):
+    link = {"sourceId": customer_id}
+    parent_id = qbd_to_filevine["customers"].get(index["parent"].get(customer_id))
+    if parent_id:
+        link["parentId"] = parent_id
+    return link
+
+def link_of(payload):
+    return {field: payload[field] for field in CONTACT_LINK_FIELDS if payload.get(field)}
+
+def sync_customers(customers, index=None):
+    headers = filevine_headers()
+    fingerprints = qbd_to_filevine["fingerprints"]["customers"]
+    conflicts = qbd_to_filevine["conflicts"]["customers"]
+    filevine_contacts = {"index": None}  # fetched lazily, at most once per run
+    index = index or build_customer_index(customers)
+    creates = {}  # depth -> create jobs
+    mapped = []
+    
+    for customer in index["order"]:
+        customer_id = getattr(customer, 'id', None)
+        if not customer_id:
+            print(f"Skipping customer {customer.full_name}: No id found")
+            continue
+        payload = customer_payload(customer)
+        fingerprint = contact_fingerprint(payload)
+        if customer_id in conflicts:
+            if conflicts[customer_id]["filevine"] != fingerprint:
+                print(f"Skipping customer {customer.full_name}: changed in both QBD and Filevine")
+                continue
+            # QBD was edited to match Filevine, so both sides agree again
+            fingerprints.setdefault(customer_id, {}).update({"qbd": fingerprint, "filevine": fingerprint})
+            del conflicts[customer_id]
+        if customer_id in qbd_to_filevine["customers"]:
+            mapped.append((customer_id, payload, fingerprint))
+            continue
+        creates.setdefault(index["depth"][customer_id], []).append((customer_id, payload, fingerprint, headers))
+
+    # One level at a time, so every parent is created (and mapped) before
+    # its jobs; a job whose parent did not make it waits for the next run
+    deferred = 0
+    for depth in sorted(creates):
+        level = []
+        for customer_id, payload, fingerprint, headers in creates[depth]:
+            link = contact_link(customer_id, index)
+            if depth and "parentId" not in link and not DRY_RUN:
+                deferred += 1
+                print(f"Skipping customer {payload['fullName']}: parent is not synced to Filevine yet")
+                continue
+            level.append((customer_id, {**payload, **link}, fingerprint, headers))
+        run_writes(create_customer, level)
+    if deferred:
+        print(f"Skipped {deferred} customers whose parent is not synced yet; the next run retries them")
+
+    # Links are built after the creates so jobs pick up parents mapped this run
+    updates = []
+    links = []
+    for customer_id, payload, fingerprint in mapped:
+        link = contact_link(customer_id, index)
+        if customer_changed(customer_id, fingerprint, headers, filevine_contacts):
+            updates.append((customer_id, {**payload, **link}, fingerprint, headers))
+        elif fingerprints[customer_id].get("link") != link:
+            links.append((customer_id, link, headers))
+    run_writes(update_customer, updates)
+    run_writes(link_customer, links)
+
+def create_customer(customer_id, payload, fingerprint, headers):
+    if DRY_RUN:
+        print(f"[dry-run] Would create customer {payload['fullName']} (QBD: {customer_id})")
+        return
     try:
-        response = requests.get(f"{FILEVINE_API}/core/expense", headers=headers)
+        # A replayed key returns the contact created by an earlier attempt
+        response = filevine_session.post(
+            f"{FILEVINE_API}/core/contacts",
+            json=payload,
+            headers={**headers, "Idempotency-Key": f"qbd-customer:{customer_id}"}
+        )
         response.raise_for_status()
-        expenses = response.json().get("data", [])
-        for expense in expenses:
-            if qbd_to_filevine["expenses"].get(expense_key) == expense.get("expenseId"):
-                return expense["expenseId"]
-        return None
+        filevine_id = response.json()["personId"]
+        qbd_to_filevine["customers"][customer_id] = filevine_id
+        qbd_to_filevine["fingerprints"]["customers"][customer_id] = {
+            "qbd": fingerprint, "filevine": fingerprint, "link": link_of(payload)
+        }
+        dead_letters.resolve("customers", [customer_id])
+        print(f"Synced customer {payload['fullName']} (QBD: {customer_id}, Filevine: {filevine_id})")
     except Exception as e:
-        print(f"Failed to check expense exists for {expense_key}: {e}")
-        return None
+        print(f"Failed to sync customer {payload['fullName']}: {e}")
+        dead_letters.record("customers", customer_id, {"payload": payload, "fingerprint": fingerprint}, str(e))
 
-def sync_customers():
+# A mapped Filevine contact needs a PATCH only when its QBD fingerprint changed.
+# Mappings written before fingerprints existed have no baseline; the first
+# run seeds it from the current Filevine record instead of rewriting it.
+def customer_changed(customer_id, fingerprint, headers, filevine_contacts):
+    fingerprints = qbd_to_filevine["fingerprints"]["customers"]
+    person_id = qbd_to_filevine["customers"][customer_id]
+    stored = fingerprints.get(customer_id)
+    if stored is None:
+        if filevine_contacts.get("index") is None:
+            try:
+                filevine_contacts["index"] = fetch_filevine_contacts(headers)
+            except Exception as e:
+                print(f"Failed to fetch Filevine contacts for fingerprint baseline: {e}")
+                filevine_contacts["index"] = {}
+        contact = filevine_contacts["index"].get(person_id)
+        if contact is not None:
+            stored = {"qbd": contact_fingerprint(contact), "filevine": contact_fingerprint(contact)}
+            fingerprints[customer_id] = stored
+    return stored is None or stored.get("qbd") != fingerprint
+
+def update_customer(customer_id, payload, fingerprint, headers):
+    fingerprints = qbd_to_filevine["fingerprints"]["customers"]
+    person_id = qbd_to_filevine["customers"][customer_id]
+    if DRY_RUN:
+        print(f"[dry-run] Would update customer {payload['fullName']} (QBD: {customer_id}, Filevine: {person_id})")
+        return
     try:
-        page = conductor.qbd.customers.list(conductor_end_user_id=END_USER_ID)
-        print(f"Fetched {len(page.data)} customers from QuickBooks: {[c.full_name for c in page.data]}")
-        if page.data:
-            print("First customer attributes:", vars(page.data[0]))
+        response = filevine_session.patch(f"{FILEVINE_API}/core/contacts/{person_id}", json=payload, headers=headers)
+        response.raise_for_status()
+        fingerprints[customer_id] = {"qbd": fingerprint, "filevine": fingerprint, "link": link_of(payload)}
+        print(f"Updated customer {payload['fullName']} (QBD: {customer_id}, Filevine: {person_id})")
     except Exception as e:
-        print(f"Failed to fetch customers: {e}")
+        print(f"Failed to update customer {payload['fullName']}: {e}")
+
+def link_customer(customer_id, link, headers):
+    person_id = qbd_to_filevine["customers"][customer_id]
+    if DRY_RUN:
+        print(f"[dry-run] Would link Filevine contact {person_id} to QBD customer {customer_id}: {link}")
         return
-    headers = {"Authorization": f"Bearer {FILEVINE_TOKEN}"}
-    
-    for customer in page.data:
-        customer_id = getattr(customer, 'id', None)
-        if not customer_id:
-            print(f"Skipping customer {customer.full_name}: No id found")
+    try:
+        response = filevine_session.patch(f"{FILEVINE_API}/core/contacts/{person_id}", json=link, headers=headers)
+        response.raise_for_status()
+        qbd_to_filevine["fingerprints"]["customers"][customer_id]["link"] = link
+        print(f"Linked Filevine contact {person_id} to QBD customer {customer_id}")
+    except Exception as e:
+        print(f"Failed to link Filevine contact {person_id} to QBD customer {customer_id}: {e}")
+
+# Pull Filevine contact edits made since the last watermark back into QBD.
+# Updated customers replace their stale entries in `customers` so the
+# forward pass that follows compares against the new QBD state.
+def sync_contacts_from_filevine(customers):
+    headers = filevine_headers()
+    fingerprints = qbd_to_filevine["fingerprints"]["customers"]
+    conflicts = qbd_to_filevine["conflicts"]["customers"]
+    since = qbd_to_filevine["watermarks"].get("contacts")
+    try:
+        changed = fetch_changed_filevine_contacts(since, headers)
+        print(f"Fetched {len(changed)} Filevine contacts changed since {since or 'the beginning'}")
+    except Exception as e:
+        print(f"Failed to fetch changed Filevine contacts: {e}")
+        return
+
+    filevine_to_qbd = {person_id: qbd_id for qbd_id, person_id in qbd_to_filevine["customers"].items()}
+    positions = {getattr(c, 'id', None): i for i, c in enumerate(customers)}
+    watermark = since
+    updates = []
+    pending = {}  # QBD id -> Filevine fingerprint being applied
+    for contact in changed:
+        if contact.get("updated_at") and (watermark is None or contact["updated_at"] > watermark):
+            watermark = contact["updated_at"]
+        qbd_id = filevine_to_qbd.get(contact.get("personId"))
+        stored = fingerprints.get(qbd_id)
+        if qbd_id not in positions or stored is None:
             continue
-        if customer_id in qbd_to_filevine["customers"]:
-            print(f"Customer {customer.full_name} already synced (in-memory)")
+        filevine_fingerprint = contact_fingerprint(contact)
+        if stored.get("filevine") == filevine_fingerprint:
+            continue  # our own write, or an edit outside the synced fields
+        customer = customers[positions[qbd_id]]
+        qbd_fingerprint = contact_fingerprint(customer_payload(customer))
+        if qbd_fingerprint == filevine_fingerprint:
+            stored.update({"qbd": qbd_fingerprint, "filevine": filevine_fingerprint})
+            conflicts.pop(qbd_id, None)
             continue
-        existing_person_id = check_customer_exists(customer_id, customer.full_name, headers)
-        if existing_person_id:
-            print(f"Customer {customer.full_name} already exists on server (Filevine: {existing_person_id})")
-            qbd_to_filevine["customers"][customer_id] = existing_person_id
+        if stored.get("qbd") != qbd_fingerprint:
+            conflicts[qbd_id] = {
+                "personId": contact["personId"],
+                "qbdFullName": customer.full_name,
+                "filevineFullName": contact.get("fullName"),
+                "filevine": filevine_fingerprint,
+                "detected_at": time.strftime('%Y-%m-%dT%H:%M:%S')
+            }
+            print(f"Conflict on customer {customer.full_name}: changed in both QBD and Filevine")
             continue
-        payload = {
-            "fullName": customer.full_name,
-            "email": getattr(customer, 'email', f"{customer_id}@example.com"),
-            "personTypes": ["Client"]
-        }
-        try:
-            response = requests.post(f"{FILEVINE_API}/core/contacts", json=payload, headers=headers)
-            response.raise_for_status()
-            filevine_id = response.json()["personId"]
-            qbd_to_filevine["customers"][customer_id] = filevine_id
-            print(f"Synced customer {customer.full_name} (QBD: {customer_id}, Filevine: {filevine_id})")
-        except Exception as e:
-            print(f"Failed to sync customer {customer.full_name}: {e}")
+        updates.append((customer, contact))
+        pending[qbd_id] = filevine_fingerprint
+
+    if DRY_RUN:
+        for customer, contact in updates:
+            print(f"[dry-run] Would update QBD customer {customer.full_name} from Filevine ({contact.get('fullName')})")
+        return
+    failed = 0
+    results = asyncio.run(update_qbd_customers(updates)) if updates else []
+    if results:
+        # New revision numbers must be re-read before the next QBD update
+        qbd_cache.expire(END_USER_ID, "customers")
+    for customer, contact, result in results:
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"Failed to update QBD customer {customer.full_name}: {result}")
+            continue
+        customers[positions[customer.id]] = result
+        qbd_fingerprint = contact_fingerprint(customer_payload(result))
+        if qbd_fingerprint != pending[customer.id]:
+            # Only the leaf name and email can be written back; anything else
+            # (the parent path, personTypes, a cleared email) still differs
+            fingerprints[customer.id]["qbd"] = qbd_fingerprint
+            conflicts[customer.id] = {
+                "personId": contact["personId"],
+                "qbdFullName": result.full_name,
+                "filevineFullName": contact.get("fullName"),
+                "filevine": pending[customer.id],
+                "detected_at": time.strftime('%Y-%m-%dT%H:%M:%S')
+            }
+            print(f"Conflict on customer {result.full_name}: Filevine changes could not all be written to QBD")
+            continue
+        fingerprints[customer.id].update({"qbd": qbd_fingerprint, "filevine": pending[customer.id]})
+        conflicts.pop(customer.id, None)
+        print(f"Updated QBD customer {result.full_name} from Filevine (QBD: {customer.id}, Filevine: {contact['personId']})")
+    # Failed records stay behind the watermark so the next run retries them
+    if not failed:
+        qbd_to_filevine["watermarks"]["contacts"] = watermark
+
+# Send customer updates to QBD through Conductor, QBD_BATCH_SIZE at a time
+async def update_qbd_customers(updates):
+    results = []
+    async with AsyncConductor(api_key=os.environ.get("CONDUCTOR_SECRET_KEY")) as async_conductor:
+        for start in range(0, len(updates), QBD_BATCH_SIZE):
+            batch = updates[start:start + QBD_BATCH_SIZE]
+            responses = await asyncio.gather(
+                *(update_qbd_customer(async_conductor, customer, contact) for customer, contact in batch),
+                return_exceptions=True
+            )
+            results.extend((customer, contact, response) for (customer, contact), response in zip(batch, responses))
+    return results
+
+# Fields of a Filevine contact that can be written back to its QBD customer.
+# QBD full names are "Parent:Job"; only the leaf name is editable here.
+def qbd_update_fields(customer, contact):
+    fields = {}
+    name = (contact.get("fullName") or "").split(":")[-1]
+    if name and name != getattr(customer, 'name', None):
+        fields["name"] = name
+    if contact.get("email") and contact["email"] != getattr(customer, 'email', None):
+        fields["email"] = contact["email"]
+    return fields
+
+async def update_qbd_customer(async_conductor, customer, contact):
+    fields = qbd_update_fields(customer, contact)
+    if not fields:
+        return customer
+    return await async_conductor.qbd.customers.update(
+        id=customer.id,
+        revision_number=customer.revision_number,
+        conductor_end_user_id=END_USER_ID,
+        **fields
+    )
+
+# Invoice lines that sync as Filevine expenses, with their mapping key
+def expense_lines(invoice):
+    for line in invoice.lines:
+        if ((SYNC_ITEM_LINES and hasattr(line, 'item') and line.item and getattr(line.item, 'full_name', '') != 'Subtotal') or
+            (not SYNC_ITEM_LINES and hasattr(line, 'account_ref') and line.account_ref)):
+            if getattr(line, 'amount', None) in (None, '0.00'):
+                continue
+            line_id = getattr(line, 'id', str(uuid.uuid4()))
+            yield line, f"{invoice.id}:{line_id}"
+
+# Filevine expense payload for an invoice line
+def expense_payload(invoice, line, project_id, accounts=None):
+    accounts = qbd_to_filevine["accounts"] if accounts is None else accounts
+    account_ref = getattr(line, 'account_ref', None)
+    account_id = account_ref.id if account_ref and hasattr(account_ref, 'id') else None
+    account_name = accounts.get(account_id, "General Expense") if account_id else None
+    item_ref = getattr(line, 'item', None)
+    item_name = getattr(item_ref, 'full_name', "General Item") if item_ref else "General Item"
+    category = account_name if account_name else item_name
+    return {
+        "projectId": project_id,
+        "description": getattr(line, 'description', "No description"),
+        "amount": float(getattr(line, 'amount', 0)),
+        "date": getattr(invoice, 'transaction_date', time.strftime('%Y-%m-%d')),
+        "category": category
+    }
 
 def sync_expenses():
     try:
-        account_page = conductor.qbd.accounts.list(conductor_end_user_id=END_USER_ID)
-        expense_accounts = [a for a in account_page.data if getattr(a, 'account_type', '').lower() == 'expense']
+        accounts = list_qbd_cached("accounts", paginated=False)
+        expense_accounts = [a for a in accounts if getattr(a, 'account_type', '').lower() == 'expense']
         print(f"Fetched {len(expense_accounts)} expense accounts from QuickBooks: {[a.full_name for a in expense_accounts]}")
         if expense_accounts:
             print("First expense account attributes:", vars(expense_accounts[0]))
     except Exception as e:
         print(f"Failed to fetch accounts: {e}")
         return
-    headers = {"Authorization": f"Bearer {FILEVINE_TOKEN}"}
+    headers = filevine_headers()
     
     for account in expense_accounts:
         account_id = getattr(account, 'id', None)
@@ -144,52 +542,274 @@ def sync_expenses():
             print(f"Mapped account {account.full_name} (QBD: {account_id})")
     
     try:
-        invoice_page = conductor.qbd.invoices.list(conductor_end_user_id=END_USER_ID)
-        print(f"Fetched {len(invoice_page.data)} invoices from QuickBooks")
+        invoices = list_qbd(get_conductor().qbd.invoices)
+        print(f"Fetched {len(invoices)} invoices from QuickBooks")
     except Exception as e:
         print(f"Failed to fetch invoices: {e}")
         return
-    for invoice in invoice_page.data:
-        for line in invoice.lines:
-            if ((SYNC_ITEM_LINES and hasattr(line, 'item') and line.item and getattr(line.item, 'full_name', '') != 'Subtotal') or
-                (not SYNC_ITEM_LINES and hasattr(line, 'account_ref') and line.account_ref)):
-                if getattr(line, 'amount', None) in (None, '0.00'):
-                    continue
-                line_id = getattr(line, 'id', str(uuid.uuid4()))
-                expense_key = f"{invoice.id}:{line_id}"
-                if expense_key in qbd_to_filevine["expenses"]:
-                    print(f"Expense {line.description} already synced (in-memory)")
+    # Lines go to the Filevine contact of the invoice's own customer or job.
+    # Lines for one not synced yet are skipped; invoices are listed again on
+    # every run, so they are picked up once it is.
+    projects = qbd_to_filevine["customers"]
+    creates = []
+    for invoice in invoices:
+        customer_ref = getattr(invoice, 'customer', None)
+        customer_id = getattr(customer_ref, 'id', None) if customer_ref else None
+        project_id = projects.get(customer_id)
+        for line, expense_key in expense_lines(invoice):
+            if expense_key in qbd_to_filevine["expenses"]:
+                print(f"Expense {line.description} already synced (in-memory)")
+                continue
+            if project_id is None:
+                print(f"Skipping expense {line.description}: customer {customer_id} is not synced to Filevine")
+                continue
+            creates.append((expense_key, expense_payload(invoice, line, project_id), headers))
+    run_writes(create_expense, creates)
+
+def create_expense(expense_key, payload, headers):
+    if DRY_RUN:
+        print(f"[dry-run] Would create expense {payload['description']} (QBD: {expense_key})")
+        return
+    filevine_id = None
+    try:
+        response = filevine_session.post(
+            f"{FILEVINE_API}/core/expense",
+            json=payload,
+            headers={**headers, "Idempotency-Key": f"qbd-expense:{expense_key}"}
+        )
+        response.raise_for_status()
+        filevine_id = response.json()["expenseId"]
+        qbd_to_filevine["expenses"][expense_key] = filevine_id
+        dead_letters.resolve("expenses", [expense_key])
+        print(f"Synced expense {payload['description']} (QBD: {expense_key}, Filevine: {filevine_id})")
+        sync_billing_item(filevine_id, expense_key, True, headers)
+    except Exception as e:
+        print(f"Failed to sync expense {payload['description']}: {e}")
+        dead_letters.record("expenses", expense_key, payload, str(e))
+        sync_billing_item(filevine_id, expense_key, False, headers, str(e))
+
+def money(value):
+    return float(value) if value not in (None, "") else None
+
+def iso_date(value):
+    return str(value) if value else None
+
+# Conductor durations are ISO 8601, e.g. "PT1H30M"
+def duration_hours(value):
+    match = re.fullmatch(r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?", value or "")
+    if not match:
+        return None
+    days, hours, minutes, seconds = (float(part) if part else 0 for part in match.groups())
+    return round(days * 24 + hours + minutes / 60 + seconds / 3600, 4)
+
+def ref_name(ref):
+    return getattr(ref, 'full_name', None) if ref else None
+
+# Filevine invoice payload for a QBD invoice
+def invoice_payload(invoice, project_id):
+    subtotal = money(getattr(invoice, 'subtotal', None))
+    tax = money(getattr(invoice, 'sales_tax_total', None)) or 0
+    return {
+        "projectId": project_id,
+        "sourceId": invoice.id,
+        "invoiceNumber": getattr(invoice, 'ref_number', None),
+        "invoiceDate": iso_date(getattr(invoice, 'transaction_date', None)),
+        "dueDate": iso_date(getattr(invoice, 'due_date', None)),
+        "memo": getattr(invoice, 'memo', None),
+        "subtotal": subtotal,
+        "total": subtotal + tax if subtotal is not None else None,
+        "balance": money(getattr(invoice, 'balance_remaining', None)),
+        "lines": [
+            {
+                "description": getattr(line, 'description', None),
+                "item": ref_name(getattr(line, 'item', None)),
+                "quantity": money(getattr(line, 'quantity', None)),
+                "rate": money(getattr(line, 'rate', None)),
+                "amount": money(getattr(line, 'amount', None))
+            }
+            for line in getattr(invoice, 'lines', None) or []
+        ]
+    }
+
+# Filevine time entry payload for a QBD time tracking activity
+def time_entry_payload(activity, project_id):
+    return {
+        "projectId": project_id,
+        "sourceId": activity.id,
+        "date": iso_date(getattr(activity, 'transaction_date', None)),
+        "hours": duration_hours(getattr(activity, 'duration', None)),
+        "description": getattr(activity, 'note', None),
+        "timekeeper": ref_name(getattr(activity, 'entity', None)),
+        "serviceItem": ref_name(getattr(activity, 'service_item', None)),
+        # "has_been_billed" is billable time already invoiced in QBD
+        "billable": getattr(activity, 'billing_status', None) != "not_billable"
+    }
+
+# Streaming billing pipelines, keyed by their qbd_to_filevine mapping
+BILLING_PIPELINES = {
+    "invoices": {
+        "resource": "invoices",
+        "path": "/core/invoice/batch",
+        "id_field": "invoiceId",
+        "key_prefix": "qbd-invoice",
+        "payload": invoice_payload
+    },
+    "time_entries": {
+        "resource": "time_tracking_activities",
+        "path": "/core/time/batch",
+        "id_field": "entryId",
+        "key_prefix": "qbd-time",
+        "payload": time_entry_payload
+    }
+}
+
+def add_counts(counts, more):
+    for key, value in more.items():
+        counts[key] = counts.get(key, 0) + value
+
+# Send one batch of creates; each item carries its own Idempotency-Key, so
+# a retried batch only creates what did not land the first time. Returns
+# the counts and the QBD ids to retry on the next run.
+def post_billing_batch(kind, batch, headers):
+    pipeline = BILLING_PIPELINES[kind]
+    if DRY_RUN:
+        print(f"[dry-run] Would create {len(batch)} {kind} (QBD: {batch[0][0]} ...)")
+        return {"planned": len(batch)}, []
+    items = [{"idempotencyKey": f"{pipeline['key_prefix']}:{qbd_id}", **payload} for qbd_id, payload in batch]
+    try:
+        response = filevine_session.post(f"{FILEVINE_API}{pipeline['path']}", json={"items": items}, headers=headers)
+        response.raise_for_status()
+        results = {result["idempotencyKey"]: result for result in response.json()["results"]}
+    except Exception as e:
+        print(f"Failed to sync {len(batch)} {kind} (QBD: {batch[0][0]} ...): {e}")
+        for qbd_id, payload in batch:
+            dead_letters.record(kind, qbd_id, payload, str(e))
+        return {"failed": len(batch)}, [qbd_id for qbd_id, _ in batch]
+    counts = {"created": 0, "replayed": 0}
+    failed = []
+    landed = []
+    for item, (qbd_id, payload) in zip(items, batch):
+        result = results.get(item["idempotencyKey"])
+        if result is None:
+            dead_letters.record(kind, qbd_id, payload, "missing from batch response")
+            add_counts(counts, {"failed": 1})
+            failed.append(qbd_id)
+            continue
+        qbd_to_filevine[kind][qbd_id] = result[pipeline["id_field"]]
+        landed.append(qbd_id)
+        counts["replayed" if result.get("replayed") else "created"] += 1
+    # Records that failed on an earlier run and landed now leave the queue
+    dead_letters.resolve(kind, landed)
+    return counts, failed
+
+# Send one batch of changes to records that were created earlier, so edits
+# to balances, totals and lines in QBD reach Filevine. A record Filevine no
+# longer has loses its mapping and goes into the pending list; the server
+# releases the idempotency key of a record that is gone, so the next run's
+# create with the same key makes a new record instead of replaying the old id.
+def update_billing_batch(kind, batch, headers):
+    pipeline = BILLING_PIPELINES[kind]
+    mapping = qbd_to_filevine[kind]
+    id_field = pipeline["id_field"]
+    if DRY_RUN:
+        print(f"[dry-run] Would update {len(batch)} {kind} (QBD: {batch[0][0]} ...)")
+        return {"planned updates": len(batch)}, []
+    items = [{id_field: mapping[qbd_id], **payload} for qbd_id, payload in batch]
+    try:
+        response = filevine_session.patch(f"{FILEVINE_API}{pipeline['path']}", json={"items": items}, headers=headers)
+        response.raise_for_status()
+        results = {result[id_field]: result for result in response.json()["results"]}
+    except Exception as e:
+        print(f"Failed to update {len(batch)} {kind} (QBD: {batch[0][0]} ...): {e}")
+        return {"failed updates": len(batch)}, [qbd_id for qbd_id, _ in batch]
+    counts = {"updated": 0}
+    missing = []
+    for item, (qbd_id, _) in zip(items, batch):
+        if results.get(item[id_field], {}).get("updated"):
+            counts["updated"] += 1
+            continue
+        print(f"{kind} record {item[id_field]} (QBD: {qbd_id}) is missing in Filevine; it will be created again on the next run")
+        mapping.pop(qbd_id, None)
+        add_counts(counts, {"missing in Filevine": 1})
+        missing.append(qbd_id)
+    return counts, missing
+
+# The updated_after stream, followed by the records earlier runs left
+# pending, which are re-read by id whatever their updated time
+def billing_records(resource, params, pending):
+    remaining = set(pending)
+    for record in iter_qbd(resource, **params):
+        remaining.discard(record.id)
+        yield record
+    ids = sorted(remaining)
+    for start in range(0, len(ids), BILLING_BATCH_SIZE):
+        yield from iter_qbd(resource, paginated=False, ids=ids[start:start + BILLING_BATCH_SIZE])
+
+# Stream QBD records page by page into Filevine batch creates. At most one
+# Conductor page, one open batch and CONCURRENCY in-flight batches are held
+# at once, so memory does not grow with the number of records. Only records
+# updated since the last run are listed; those already mapped are sent as
+# batch updates. Deferred and failed records are kept in the pending list
+# instead of holding the watermark back.
+def sync_billing(kind):
+    pipeline = BILLING_PIPELINES[kind]
+    mapping = qbd_to_filevine[kind]
+    since = qbd_to_filevine["watermarks"].get(kind)
+    started = time.time()
+    projects = qbd_to_filevine["customers"]
+    headers = filevine_headers()
+    params = {"updated_after": since} if since else {}
+    pending = qbd_to_filevine["pending"].get(kind) or []
+    counts = {}
+    retry = set()
+    batches = {post_billing_batch: [], update_billing_batch: []}
+    in_flight = deque()
+
+    def collect(future):
+        more, failed = future.result()
+        add_counts(counts, more)
+        retry.update(failed)
+
+    try:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            resource = getattr(get_conductor().qbd, pipeline["resource"])
+            for record in billing_records(resource, params, pending):
+                customer = getattr(record, 'customer', None)
+                if customer is None:
+                    add_counts(counts, {"no customer": 1})
                     continue
-                existing_expense_id = check_expense_exists(expense_key, headers)
-                if existing_expense_id:
-                    print(f"Expense {line.description} already exists on server (Filevine: {existing_expense_id})")
-                    qbd_to_filevine["expenses"][expense_key] = existing_expense_id
+                project_id = projects.get(getattr(customer, 'id', None))
+                if project_id is None:
+                    add_counts(counts, {"deferred": 1})  # customer not synced yet
+                    retry.add(record.id)
                     continue
-                account_ref = getattr(line, 'account_ref', None)
-                account_id = account_ref.id if account_ref and hasattr(account_ref, 'id') else None
-                account_name = qbd_to_filevine["accounts"].get(account_id, "General Expense") if account_id else None
-                item_ref = getattr(line, 'item', None)
-                item_name = getattr(item_ref, 'full_name', "General Item") if item_ref else "General Item"
-                category = account_name if account_name else item_name
-                customer_ref = getattr(invoice, 'customer', None)
-                project_id = customer_ref.id if customer_ref and hasattr(customer_ref, 'id') else "Unknown"
-                payload = {
-                    "projectId": project_id,
-                    "description": getattr(line, 'description', "No description"),
-                    "amount": float(getattr(line, 'amount', 0)),
-                    "date": getattr(invoice, 'transaction_date', time.strftime('%Y-%m-%d')),
-                    "category": category
-                }
-                try:
-                    response = requests.post(f"{FILEVINE_API}/core/expense", json=payload, headers=headers)
-                    response.raise_for_status()
-                    filevine_id = response.json()["expenseId"]
-                    qbd_to_filevine["expenses"][expense_key] = filevine_id
-                    print(f"Synced expense {payload['description']} (QBD: {expense_key}, Filevine: {filevine_id})")
-                    sync_billing_item(filevine_id, expense_key, True, headers)
-                except Exception as e:
-                    print(f"Failed to sync expense {payload['description']}: {e}")
-                    sync_billing_item(filevine_id, expense_key, False, headers, str(e))
+                send = update_billing_batch if record.id in mapping else post_billing_batch
+                batches[send].append((record.id, pipeline["payload"](record, project_id)))
+                if len(batches[send]) >= BILLING_BATCH_SIZE:
+                    in_flight.append(executor.submit(send, kind, batches[send], headers))
+                    batches[send] = []
+                    if len(in_flight) >= CONCURRENCY:
+                        collect(in_flight.popleft())
+            for send, batch in batches.items():
+                if batch:
+                    in_flight.append(executor.submit(send, kind, batch, headers))
+            while in_flight:
+                collect(in_flight.popleft())
+    except Exception as e:
+        print(f"Failed to stream {kind} from QuickBooks: {e}")
+        return
+    print(f"Synced {kind} since {since or 'the beginning'}: {counts or 'nothing to do'}")
+    if retry:
+        print(f"{len(retry)} {kind} left pending for the next run")
+    if not DRY_RUN:
+        qbd_to_filevine["pending"][kind] = sorted(retry)
+        qbd_to_filevine["watermarks"][kind] = qbd_cache.updated_after(started)
+
+def sync_invoices():
+    sync_billing("invoices")
+
+def sync_time_entries():
+    sync_billing("time_entries")
 
 def sync_billing_item(billing_item_id, system_id, success, headers, note=None):
     payload = [
@@ -201,21 +821,38 @@ def sync_billing_item(billing_item_id, system_id, success, headers, note=None):
         }
     ]
     try:
-        response = requests.put(f"{FILEVINE_API}/fv-app/v2/AccountingSync", json=payload, headers=headers)
+        response = filevine_session.put(f"{FILEVINE_API}/fv-app/v2/AccountingSync", json=payload, headers=headers)
         response.raise_for_status()
         print(f"Updated sync status for BillingItemId {billing_item_id}: {response.json()}")
     except Exception as e:
         print(f"Failed to update sync status for BillingItemId {billing_item_id}: {e}")
 
-def sync():
+# Contacts phase: Filevine edits back to QBD first, then QBD to Filevine
+def sync_contacts():
+    customers = fetch_qbd_customers()
+    if customers is not None:
+        sync_contacts_from_filevine(customers)
+        sync_customers(customers, build_customer_index(customers))
+
+def save_mappings():
+    with open(f"mappings_{uuid.uuid4()}.json", "w") as f:
+        json.dump(qbd_to_filevine, f, indent=2)
+    save_http_cache()
+
+# Default phases for a full sync, in order
+SYNC_PHASES = (sync_contacts, sync_expenses, sync_invoices, sync_time_entries)
+
+def sync(phases=SYNC_PHASES):
     try:
         print(f"Starting sync at {time.strftime('%Y-%m-%d %H:%M:%S')}")
         load_mappings()
-        sync_customers()
-        sync_expenses()
+        for phase in phases:
+            phase()
         print("Sync completed.")
-        with open(f"mappings_{uuid.uuid4()}.json", "w") as f:
-            json.dump(qbd_to_filevine, f, indent=2)
+        if DRY_RUN:
+            print("Dry run: mappings not saved")
+        else:
+            save_mappings()
     except Exception as e:
         print(f"Sync failed: {e}")
 
@@ -0,0 +1,44 @@
+import pytest
+
+from server.billing import create_batch, invoice_record, update_batch
+from server.storage import JsonStorage, SQLiteStorage
+
+COLLECTIONS = {"invoices": "invoiceId"}
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStorage(tmp_path / "filevine.db", COLLECTIONS)
+    return JsonStorage(tmp_path, COLLECTIONS)
+
+
+def test_batch_replay_returns_original_results(storage):
+    items = [{"idempotencyKey": f"qbd-invoice:{n}", "sourceId": str(n), "total": n} for n in range(3)]
+    first = create_batch(storage, "invoices", "invoiceId", invoice_record, items)
+    assert [r["replayed"] for r in first] == [False, False, False]
+
+    # A retried batch with one new item keeps input order and only creates the new one
+    retry = create_batch(storage, "invoices", "invoiceId", invoice_record,
+                         items[:2] + [{"idempotencyKey": "qbd-invoice:9", "sourceId": "9"}] + items[2:])
+    assert [r["invoiceId"] for r in retry[:2]] == [r["invoiceId"] for r in first[:2]]
+    assert retry[3]["invoiceId"] == first[2]["invoiceId"]
+    assert [r["replayed"] for r in retry] == [True, True, False, True]
+    assert len(storage.all("invoices")) == 4
+
+
+def test_missing_record_is_created_again_with_the_same_key(storage):
+    items = [{"idempotencyKey": "qbd-invoice:1", "sourceId": "1", "balance": 10}]
+    [created] = create_batch(storage, "invoices", "invoiceId", invoice_record, items)
+    storage.delete("invoices", created["invoiceId"])
+
+    # The sync drops the mapping when an update reports the record missing ...
+    [updated] = update_batch(storage, "invoices", "invoiceId", [{"invoiceId": created["invoiceId"], "balance": 0}])
+    assert updated == {"invoiceId": created["invoiceId"], "updated": False}
+
+    # ... and the next run's create with the same key must not replay the dead id
+    [again] = create_batch(storage, "invoices", "invoiceId", invoice_record, items)
+    assert not again["replayed"] and again["invoiceId"] != created["invoiceId"]
+    [update] = update_batch(storage, "invoices", "invoiceId", [{"invoiceId": again["invoiceId"], "balance": 0}])
+    assert update["updated"]
+    assert [r["balance"] for r in storage.all("invoices")] == [0]
@@ -0,0 +1,62 @@
+import pytest
+
+import dead_letters
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(dead_letters, "DEAD_LETTER_DB", str(tmp_path / "dead_letters.db"))
+    monkeypatch.setattr(dead_letters, "connection", None)
+
+
+def test_repeated_failures_update_one_row():
+    dead_letters.record("invoices", "1", {"total": 1}, "timeout")
+    dead_letters.record("invoices", "1", {"total": 2}, "HTTP 500")
+    dead_letters.record("invoices", "2", {"total": 3}, "timeout")
+
+    rows = dead_letters.pending("invoices")
+    assert [(key, payload, attempts) for _, key, payload, attempts in rows] == [("1", {"total": 2}, 2), ("2", {"total": 3}, 1)]
+    assert [key for _, key, _, _ in dead_letters.pending("invoices", max_attempts=2)] == ["2"]
+    assert dead_letters.summary()["invoices"]["records"] == 2
+
+
+def test_pending_pages_by_rowid_and_resolve_drops_rows():
+    for key in "abc":
+        dead_letters.record("expenses", key, {}, "timeout")
+    first = dead_letters.pending("expenses", limit=2)
+    assert [key for _, key, _, _ in first] == ["a", "b"]
+    assert [key for _, key, _, _ in dead_letters.pending("expenses", after=first[-1][0])] == ["c"]
+
+    dead_letters.resolve("expenses", ["a", "c"])
+    assert [key for _, key, _, _ in dead_letters.pending("expenses")] == ["b"]
+    dead_letters.resolve("expenses", ["b"])
+    assert dead_letters.summary() == {}
+
+
+def test_replay_resends_only_failed_records(monkeypatch):
+    for module in ("requests", "conductor", "dotenv", "schedule"):
+        pytest.importorskip(module)
+    import replay
+    import sync
+
+    monkeypatch.setitem(sync.qbd_to_filevine, "invoices", {"1": "fv-1"})
+    monkeypatch.setattr(sync, "load_mappings", lambda: None)
+    monkeypatch.setattr(sync, "save_mappings", lambda: None)
+    monkeypatch.setattr(sync, "FILEVINE_TOKEN", "token")
+    sent = []
+
+    # Invoice 2 lands on its retry; invoice 3 keeps failing
+    def send(rows, headers):
+        sent.append([key for key, _ in rows])
+        if len(sent) > 1:
+            sync.qbd_to_filevine["invoices"]["2"] = "fv-2"
+
+    monkeypatch.setitem(replay.SENDERS, "invoices", send)
+    for key in "123":
+        dead_letters.record("invoices", key, {}, "timeout")
+
+    totals = replay.replay(["invoices"], retries=2, backoff=0)
+
+    assert totals == {"invoices": {"resent": 1, "already synced": 1, "still failing": 1}}
+    assert sent == [["2", "3"], ["2", "3"], ["3"]]
+    assert [key for _, key, _, _ in dead_letters.pending("invoices")] == ["3"]
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+import fast_filevine
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(fast_filevine, "cache_dir", tmp_path)
+    with TestClient(fast_filevine.app) as client:
+        yield client
+
+
+def test_contact_patch_clears_fields_sent_as_null(client):
+    client.post("/core/contacts", json={"personId": "p1", "fullName": "Ann", "email": "ann@example.com", "parentId": "p0"})
+
+    assert client.patch("/core/contacts/p1", json={"email": None}).status_code == 200
+    [contact] = client.get("/core/contacts", params={"personId": "p1"}).json()
+    # Only the fields sent are touched; the unsent parentId is kept
+    assert contact["email"] is None and contact["parentId"] == "p0"
+
+
+def test_contact_patch_cannot_clear_full_name(client):
+    client.post("/core/contacts", json={"personId": "p1", "fullName": "Ann"})
+    assert client.patch("/core/contacts/p1", json={"fullName": None}).status_code == 422
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from hierarchy import build_customer_index
+
+
+def customer(customer_id, full_name, parent_id=None):
+    parent = SimpleNamespace(id=parent_id) if parent_id else None
+    return SimpleNamespace(id=customer_id, full_name=full_name, parent=parent)
+
+
+def test_parents_come_before_their_jobs():
+    # Listed jobs-first, the way QBD may return them
+    customers = [
+        customer("3", "Abercrombie, Kristy:Family Room:Paint", "2"),
+        customer("2", "Abercrombie, Kristy:Family Room", "1"),
+        customer("5", "Babcock's Music Shop:Remodel", "4"),
+        customer("1", "Abercrombie, Kristy"),
+        customer("4", "Babcock's Music Shop"),
+    ]
+    index = build_customer_index(customers)
+
+    assert [c.id for c in index["order"]] == ["1", "4", "2", "5", "3"]
+    assert index["depth"] == {"1": 0, "4": 0, "2": 1, "5": 1, "3": 2}
+    assert index["parent"] == {"3": "2", "2": "1", "5": "4"}
+
+
+def test_full_name_prefix_is_used_without_a_parent_ref():
+    index = build_customer_index([customer("2", "Acme:Job"), customer("1", "Acme")])
+    assert [c.id for c in index["order"]] == ["1", "2"]
+    assert index["parent"] == {"2": "1"}
+
+
+def test_orphans_are_roots_and_cycles_are_appended():
+    customers = [
+        customer("a", "Loop A", "b"),
+        customer("b", "Loop B", "a"),
+        customer("j", "Gone:Job", "missing"),
+        customer("r", "Root"),
+    ]
+    index = build_customer_index(customers)
+
+    assert [c.id for c in index["order"]] == ["j", "r", "a", "b"]
+    assert index["depth"]["j"] == 0 and index["depth"]["a"] == 0
+
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("conductor")
+pytest.importorskip("dotenv")
+pytest.importorskip("schedule")
+
+import plan as planner
+import sync
+
+
+def activity(qbd_id, customer_id, duration="PT1H"):
+    customer = SimpleNamespace(id=customer_id) if customer_id else None
+    return SimpleNamespace(id=qbd_id, customer=customer, duration=duration, billing_status="billable")
+
+
+def test_plan_billing(monkeypatch):
+    monkeypatch.setitem(sync.qbd_to_filevine, "time_entries", {"t1": "e1", "t2": "e2", "t3": "e3"})
+    unchanged = sync.time_entry_payload(activity("t1", "c1"), "p1")
+    filevine = [{"entryId": "e1", **unchanged}, {"entryId": "e2", **unchanged, "sourceId": "t2", "hours": 2.0}]
+    records = [
+        activity("t1", "c1"),
+        activity("t2", "c1", "PT1H30M"),
+        activity("t3", "c1"),
+        activity("t4", "c1"),
+        activity("t5", "c2"),
+        activity("t6", None),
+    ]
+    plan = {"changes": [], "skips": {}}
+    planner.plan_billing(plan, "time_entries", {"c1": "p1"}, records, filevine)
+
+    assert [(c["action"], c["qbdId"]) for c in plan["changes"]] == [("update", "t2"), ("update", "t3"), ("create", "t4")]
+    assert plan["changes"][0]["changes"] == {"hours": [2.0, 1.5]}
+    assert plan["changes"][1]["missingInFilevine"]
+    assert plan["skips"] == {"time_entries: unchanged": 1, "time_entries: customer not synced": 1,
+                             "time_entries: no customer": 1}
@@ -0,0 +1,73 @@
+import pytest
+
+import qbd_cache
+
+USER = "end_usr_test"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(qbd_cache, "CACHE_DIR", str(tmp_path))
+
+
+# Conductor list stand-in that records the params of every call
+class Fetch:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def __call__(self, **params):
+        self.calls.append(params)
+        return self.results.pop(0)
+
+
+def age(entity, seconds):
+    path = qbd_cache.cache_path(USER, entity)
+    entry = qbd_cache.load_entry(path)
+    entry["fetched_at"] -= seconds
+    qbd_cache.save_entry(path, entry)
+    return entry["fetched_at"]
+
+
+def test_fresh_entry_is_served_without_fetching():
+    fetch = Fetch([{"id": "1", "name": "Ann"}])
+    qbd_cache.read_through(USER, "customers", fetch)
+    [customer] = qbd_cache.read_through(USER, "customers", fetch)
+    assert customer.name == "Ann" and fetch.calls == [{}]
+
+
+def test_stale_entry_is_revalidated_and_merged():
+    fetch = Fetch([{"id": "1", "name": "Ann"}, {"id": "2", "name": "Bob"}],
+                  [{"id": "2", "name": "Robert"}, {"id": "3", "name": "Cy"}])
+    qbd_cache.read_through(USER, "customers", fetch)
+    fetched_at = age("customers", qbd_cache.TTLS["customers"] + 1)
+
+    customers = qbd_cache.read_through(USER, "customers", fetch)
+
+    assert fetch.calls[1] == {"updated_after": qbd_cache.updated_after(fetched_at)}
+    assert [(c.id, c.name) for c in customers] == [("1", "Ann"), ("2", "Robert"), ("3", "Cy")]
+
+
+def test_expired_entry_is_revalidated():
+    fetch = Fetch([{"id": "1", "name": "Ann"}], [])
+    qbd_cache.read_through(USER, "customers", fetch)
+    qbd_cache.expire(USER, "customers")
+    qbd_cache.read_through(USER, "customers", fetch)
+    assert "updated_after" in fetch.calls[1]
+
+
+def test_old_entry_is_listed_in_full():
+    fetch = Fetch([{"id": "1"}, {"id": "2"}], [{"id": "2"}])
+    qbd_cache.read_through(USER, "customers", fetch)
+    age("customers", qbd_cache.FULL_REFRESH_AFTER + 1)
+
+    # A full list drops records deleted in QBD
+    assert [c.id for c in qbd_cache.read_through(USER, "customers", fetch)] == ["2"]
+    assert fetch.calls == [{}, {}]
+
+
+def test_uncached_entity_always_fetches():
+    fetch = Fetch([{"id": "1"}], [{"id": "1"}])
+    qbd_cache.read_through(USER, "invoices", fetch)
+    qbd_cache.read_through(USER, "invoices", fetch)
+    assert len(fetch.calls) == 2 and qbd_cache.snapshot(USER, "invoices") is None
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("conductor")
+pytest.importorskip("dotenv")
+pytest.importorskip("schedule")
+
+import reconcile
+import sync
+from fingerprints import bucket_digests, contact_fingerprint
+from server.storage import SQLiteStorage
+
+BUCKETS = 4
+
+
+class Response:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        assert self.status_code == 200
+
+    def json(self):
+        return self.body
+
+
+# The mock server's digest, bucket and by-id reads over its own storage
+class Filevine:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, url, params, headers):
+        path = url[len(sync.FILEVINE_API):]
+        collection, key = ("contacts", "personId") if path.endswith("contacts") else ("expenses", "expenseId")
+        if path.startswith("/core/digest/"):
+            fingerprint = contact_fingerprint if collection == "contacts" else lambda r: ""
+            digests, counts = bucket_digests(
+                ((r[key], fingerprint(r)) for r in self.storage.sourced(collection)), params["buckets"]
+            )
+            duplicates = [{"fullName": name, "ids": ids} for name, ids in self.storage.duplicates(collection, "fullName")]
+            return Response({"digests": digests, "counts": counts, "duplicates": duplicates})
+        if "bucket" in params:
+            return Response(self.storage.sourced_in_bucket(collection, params["bucket"], params["buckets"]))
+        record = self.storage.get(collection, params[key])
+        return Response([record]) if record else Response({}, 404)
+
+
+@pytest.fixture
+def filevine(monkeypatch, tmp_path):
+    state = json.loads(json.dumps(sync.qbd_to_filevine))
+    monkeypatch.setattr(sync, "qbd_to_filevine", state)
+    storage = SQLiteStorage(tmp_path / "filevine.db", {"contacts": "personId", "expenses": "expenseId"})
+    monkeypatch.setattr(sync, "filevine_session", Filevine(storage))
+    return storage
+
+
+# A contact the sync created for QBD customer qbd_id, with its fingerprint
+def synced_contact(storage, qbd_id, full_name):
+    contact = {"personId": f"p{qbd_id}", "fullName": full_name, "sourceId": qbd_id}
+    storage.insert_idempotent("contacts", contact, {"personId": contact["personId"]}, f"qbd-customer:{qbd_id}")
+    fingerprint = contact_fingerprint(contact)
+    sync.qbd_to_filevine["customers"][qbd_id] = contact["personId"]
+    sync.qbd_to_filevine["fingerprints"]["customers"][qbd_id] = {"qbd": fingerprint, "filevine": fingerprint}
+
+
+def test_contact_drift(filevine):
+    synced_contact(filevine, "1", "Ann")
+    synced_contact(filevine, "2", "Bob")
+    filevine.update("contacts", "p2", {"fullName": "Robert"})
+    synced_contact(filevine, "3", "Cy")
+    filevine.delete("contacts", "p3")
+    # Synced before contacts carried a sourceId
+    filevine.insert("contacts", {"personId": "p4", "fullName": "Dee"})
+    sync.qbd_to_filevine["customers"]["4"] = "p4"
+    sync.qbd_to_filevine["fingerprints"]["customers"]["4"] = {"filevine": contact_fingerprint({"fullName": "Dee"})}
+    # A sync-created copy of Ann that lost its mapping, and a hand-entered Ann
+    filevine.insert("contacts", {"personId": "p5", "fullName": "Ann", "sourceId": "5"})
+    filevine.insert("contacts", {"personId": "hand", "fullName": "Ann"})
+
+    _, actions = reconcile.reconcile_contacts({}, BUCKETS)
+
+    found = sorted((a["action"], a.get("personId")) for a in actions)
+    assert found == [("delete_duplicate_contact", "p5"), ("link_contact", "p4"), ("recreate_contact", "p3"),
+                     ("resync_contact", "p2"), ("review_unmapped_contact", "p5")]
+
+
+def test_expense_drift(filevine):
+    for n in (1, 2):
+        filevine.insert_idempotent("expenses", {"expenseId": f"e{n}"}, {"expenseId": f"e{n}"}, f"qbd-expense:{n}")
+        sync.qbd_to_filevine["expenses"][str(n)] = f"e{n}"
+    filevine.delete("expenses", "e2")
+    # Created before expenses carried an Idempotency-Key
+    filevine.insert("expenses", {"expenseId": "e3"})
+    sync.qbd_to_filevine["expenses"]["3"] = "e3"
+
+    _, actions = reconcile.reconcile_expenses({}, BUCKETS)
+
+    assert [(a["action"], a["expenseId"]) for a in actions] == [("recreate_expense", "e2")]
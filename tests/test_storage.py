@@ -0,0 +1,119 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from server.storage import JsonStorage, SQLiteStorage
+
+COLLECTIONS = {"contacts": "personId", "invoices": "invoiceId"}
+
+
+def open_backend(backend, tmp_path):
+    if backend == "sqlite":
+        return SQLiteStorage(tmp_path / "filevine.db", COLLECTIONS)
+    return JsonStorage(tmp_path, COLLECTIONS)
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def storage(request, tmp_path):
+    return open_backend(request.param, tmp_path)
+
+
+def test_insert_idempotent_replays_original_result(storage):
+    result, created = storage.insert_idempotent("contacts", {"personId": "p1", "fullName": "Ann"}, {"personId": "p1"}, "k1")
+    assert created and result == {"personId": "p1"}
+
+    result, created = storage.insert_idempotent("contacts", {"personId": "p2", "fullName": "Ann"}, {"personId": "p2"}, "k1")
+    assert not created and result == {"personId": "p1"}
+    assert [r["personId"] for r in storage.all("contacts")] == ["p1"]
+
+
+def test_idempotency_keys_are_scoped_per_collection(storage):
+    storage.insert_idempotent("contacts", {"personId": "p1"}, {"personId": "p1"}, "k1")
+    _, created = storage.insert_idempotent("invoices", {"invoiceId": "i1"}, {"invoiceId": "i1"}, "k1")
+    assert created
+
+
+def test_deleted_record_releases_its_key(storage):
+    storage.insert_idempotent("contacts", {"personId": "p1"}, {"personId": "p1"}, "k1")
+    assert storage.delete("contacts", "p1")
+
+    result, created = storage.insert_idempotent("contacts", {"personId": "p2"}, {"personId": "p2"}, "k1")
+    assert created and result == {"personId": "p2"}
+    assert [r["personId"] for r in storage.all("contacts")] == ["p2"]
+
+
+def test_key_of_missing_record_is_not_replayed(tmp_path):
+    storage = SQLiteStorage(tmp_path / "filevine.db", COLLECTIONS)
+    storage.insert_many_idempotent("invoices", [({"invoiceId": "i1"}, {"invoiceId": "i1"}, "k1")])
+    # Removed behind the storage API's back, e.g. by hand in the database
+    storage._conn().execute("DELETE FROM records WHERE collection = 'invoices'")
+
+    results = storage.insert_many_idempotent("invoices", [({"invoiceId": "i2"}, {"invoiceId": "i2"}, "k1")])
+    assert results == [({"invoiceId": "i2"}, True)]
+
+
+def test_duplicates_ignore_hand_entered_records(storage):
+    storage.insert("contacts", {"personId": "hand", "fullName": "Ann"})
+    storage.insert_idempotent("contacts", {"personId": "p1", "fullName": "Ann"}, {"personId": "p1"}, "k1")
+    assert storage.duplicates("contacts", "fullName") == []
+
+    storage.insert_idempotent("contacts", {"personId": "p2", "fullName": "Ann"}, {"personId": "p2"}, "k2")
+    assert storage.duplicates("contacts", "fullName") == [("Ann", ["p1", "p2"])]
+
+
+def test_insert_many_idempotent(storage):
+    storage.insert_idempotent("invoices", {"invoiceId": "i0"}, {"invoiceId": "i0"}, "k0")
+    results = storage.insert_many_idempotent("invoices", [
+        ({"invoiceId": "i1"}, {"invoiceId": "i1"}, "k1"),
+        ({"invoiceId": "i2"}, {"invoiceId": "i2"}, "k0"),
+        ({"invoiceId": "i3"}, {"invoiceId": "i3"}, "k1"),
+    ])
+    # k0 was stored earlier and k1 repeats within the batch; both replay the first result
+    assert results == [({"invoiceId": "i1"}, True), ({"invoiceId": "i0"}, False), ({"invoiceId": "i1"}, False)]
+    assert sorted(r["invoiceId"] for r in storage.all("invoices")) == ["i0", "i1"]
+
+
+def open_storage_in_process(db_path):
+    return SQLiteStorage(db_path, COLLECTIONS).sourced("contacts")
+
+
+def test_legacy_database_is_migrated_once(tmp_path):
+    db_path = tmp_path / "filevine.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE records (collection TEXT NOT NULL, id TEXT NOT NULL, body TEXT NOT NULL, updated_at TEXT,
+                              PRIMARY KEY (collection, id));
+        CREATE TABLE idempotency_keys (collection TEXT NOT NULL, key TEXT NOT NULL, result TEXT NOT NULL,
+                                       created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (collection, key));
+        INSERT INTO records VALUES ('contacts', 'p1', '{"personId": "p1", "sourceId": "80000001"}', NULL);
+        INSERT INTO records VALUES ('contacts', 'p2', '{"personId": "p2"}', NULL);
+        INSERT INTO records VALUES ('contacts', 'p3', '{"personId": "p3"}', NULL);
+        INSERT INTO idempotency_keys (collection, key, result) VALUES ('contacts', 'qbd-customer:2', '{"personId": "p2"}');
+    """)
+    conn.commit()
+    conn.close()
+
+    # Processes opening the same legacy database race to migrate it
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        results = pool.map(open_storage_in_process, [db_path] * 4)
+
+    assert all(sorted(r["personId"] for r in result) == ["p1", "p2"] for result in results)
+
+
+def insert_once(args):
+    db_path, record_id = args
+    storage = SQLiteStorage(db_path, COLLECTIONS)
+    return storage.insert_idempotent("contacts", {"personId": record_id}, {"personId": record_id}, "shared-key")
+
+
+def test_insert_idempotent_across_processes(tmp_path):
+    db_path = tmp_path / "filevine.db"
+    SQLiteStorage(db_path, COLLECTIONS)
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        results = pool.map(insert_once, [(db_path, f"p{n}") for n in range(8)])
+
+    assert sum(created for _, created in results) == 1
+    winner = next(result for result, created in results if created)
+    assert all(result == winner for result, _ in results)
+    assert SQLiteStorage(db_path, COLLECTIONS).all("contacts") == [winner]
@@ -0,0 +1,128 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("conductor")
+pytest.importorskip("dotenv")
+pytest.importorskip("schedule")
+
+import dead_letters
+import sync
+
+
+@pytest.mark.parametrize("status, billable", [
+    ("billable", True),
+    ("has_been_billed", True),
+    ("not_billable", False),
+])
+def test_time_entry_billable_status(status, billable):
+    activity = SimpleNamespace(id="t1", billing_status=status)
+    assert sync.time_entry_payload(activity, "p1")["billable"] is billable
+
+
+class Page:
+    def __init__(self, data):
+        self.data = data
+
+
+# Conductor time tracking activities: the updated_after stream returns
+# `changed`, an ids= read returns any known record
+class Activities:
+    def __init__(self, records, changed):
+        self.records = {r.id: r for r in records}
+        self.changed = changed
+        self.calls = []
+
+    def list(self, conductor_end_user_id, ids=None, **params):
+        self.calls.append(ids or params)
+        if ids is not None:
+            return Page([self.records[i] for i in ids if i in self.records])
+        return Page([self.records[i] for i in self.changed])
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+# Filevine time entry batches, holding the created entries by id
+class Filevine:
+    def __init__(self):
+        self.entries = {}
+
+    def post(self, url, json, headers):
+        results = []
+        for item in json["items"]:
+            entry_id = f"e-{item['sourceId']}"
+            self.entries[entry_id] = item
+            results.append({"idempotencyKey": item["idempotencyKey"], "entryId": entry_id, "replayed": False})
+        return Response({"results": results})
+
+    def patch(self, url, json, headers):
+        return Response({"results": [{"entryId": item["entryId"], "updated": item["entryId"] in self.entries}
+                                     for item in json["items"]]})
+
+
+def activity(qbd_id, customer_id):
+    return SimpleNamespace(id=qbd_id, customer=SimpleNamespace(id=customer_id), duration="PT1H", billing_status="billable")
+
+
+@pytest.fixture
+def filevine(monkeypatch, tmp_path):
+    state = json.loads(json.dumps(sync.qbd_to_filevine))
+    monkeypatch.setattr(sync, "qbd_to_filevine", state)
+    monkeypatch.setattr(sync, "FILEVINE_TOKEN", "token")
+    monkeypatch.setattr(dead_letters, "DEAD_LETTER_DB", str(tmp_path / "dead_letters.db"))
+    monkeypatch.setattr(dead_letters, "connection", None)
+    filevine = Filevine()
+    monkeypatch.setattr(sync, "filevine_session", filevine)
+    return filevine
+
+
+def run_sync(monkeypatch, activities):
+    monkeypatch.setattr(sync, "get_conductor", lambda: SimpleNamespace(qbd=SimpleNamespace(time_tracking_activities=activities)))
+    sync.sync_billing("time_entries")
+
+
+def test_deferred_records_stay_pending_until_their_customer_syncs(monkeypatch, filevine):
+    sync.qbd_to_filevine["customers"]["c1"] = "p1"
+    records = [activity("t1", "c1"), activity("t2", "c2")]
+    run_sync(monkeypatch, Activities(records, ["t1", "t2"]))
+
+    assert sync.qbd_to_filevine["time_entries"] == {"t1": "e-t1"}
+    assert sync.qbd_to_filevine["pending"]["time_entries"] == ["t2"]
+    # The watermark moves on; t2 is not held back behind it
+    watermark = sync.qbd_to_filevine["watermarks"]["time_entries"]
+    assert watermark is not None
+
+    # Nothing changed in QBD since, but the pending record is re-read by id
+    sync.qbd_to_filevine["customers"]["c2"] = "p2"
+    activities = Activities(records, [])
+    run_sync(monkeypatch, activities)
+
+    assert activities.calls == [{"updated_after": watermark}, ["t2"]]
+    assert sync.qbd_to_filevine["time_entries"] == {"t1": "e-t1", "t2": "e-t2"}
+    assert sync.qbd_to_filevine["pending"]["time_entries"] == []
+
+
+def test_record_missing_in_filevine_is_created_again(monkeypatch, filevine):
+    sync.qbd_to_filevine["customers"]["c1"] = "p1"
+    records = [activity("t1", "c1")]
+    run_sync(monkeypatch, Activities(records, ["t1"]))
+    del filevine.entries["e-t1"]
+
+    run_sync(monkeypatch, Activities(records, ["t1"]))
+    assert sync.qbd_to_filevine["time_entries"] == {}
+    assert sync.qbd_to_filevine["pending"]["time_entries"] == ["t1"]
+
+    run_sync(monkeypatch, Activities(records, []))
+    assert sync.qbd_to_filevine["time_entries"] == {"t1": "e-t1"}
+    assert "e-t1" in filevine.entries
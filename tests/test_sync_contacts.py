@@ -0,0 +1,171 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("conductor")
+pytest.importorskip("dotenv")
+pytest.importorskip("schedule")
+
+import dead_letters
+import qbd_cache
+import sync
+from fingerprints import contact_fingerprint
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+# Filevine contacts, recording every write
+class Filevine:
+    def __init__(self):
+        self.writes = []
+
+    def post(self, url, json, headers):
+        self.writes.append(("POST", url, json))
+        return Response({"personId": f"p-{json['sourceId']}"})
+
+    def patch(self, url, json, headers):
+        self.writes.append(("PATCH", url, json))
+        return Response({"personId": url.rsplit("/", 1)[-1]})
+
+
+def customer(qbd_id, name, email=None):
+    return SimpleNamespace(id=qbd_id, name=name, full_name=name, email=email, parent=None, revision_number="1")
+
+
+@pytest.fixture
+def filevine(monkeypatch, tmp_path):
+    state = json.loads(json.dumps(sync.qbd_to_filevine))
+    monkeypatch.setattr(sync, "qbd_to_filevine", state)
+    monkeypatch.setattr(sync, "FILEVINE_TOKEN", "token")
+    monkeypatch.setattr(dead_letters, "DEAD_LETTER_DB", str(tmp_path / "dead_letters.db"))
+    monkeypatch.setattr(dead_letters, "connection", None)
+    monkeypatch.setattr(qbd_cache, "CACHE_DIR", str(tmp_path / "qbd"))
+    filevine = Filevine()
+    monkeypatch.setattr(sync, "filevine_session", filevine)
+    return filevine
+
+
+# A customer already synced as Filevine contact p-<id>
+def synced(qbd_id, payload):
+    fingerprint = contact_fingerprint(payload)
+    sync.qbd_to_filevine["customers"][qbd_id] = f"p-{qbd_id}"
+    sync.qbd_to_filevine["fingerprints"]["customers"][qbd_id] = {
+        "qbd": fingerprint, "filevine": fingerprint, "link": {"sourceId": qbd_id}
+    }
+
+
+def test_only_changed_customers_are_patched(filevine):
+    unchanged = customer("1", "Ann", "ann@example.com")
+    cleared = customer("2", "Bob", "bob@example.com")
+    synced("1", sync.customer_payload(unchanged))
+    synced("2", sync.customer_payload(cleared))
+    cleared.email = None
+
+    sync.sync_customers([unchanged, cleared])
+
+    [(method, url, payload)] = filevine.writes
+    assert (method, url) == ("PATCH", f"{sync.FILEVINE_API}/core/contacts/p-2")
+    # The cleared email is sent as an explicit null so Filevine clears it too
+    assert "email" in payload and payload["email"] is None
+    stored = sync.qbd_to_filevine["fingerprints"]["customers"]["2"]
+    assert stored["qbd"] == stored["filevine"] == contact_fingerprint(sync.customer_payload(cleared))
+
+
+def test_conflicted_customer_is_not_overwritten(filevine):
+    ann = customer("1", "Ann", "ann@example.com")
+    synced("1", sync.customer_payload(ann))
+    ann.email = "ann@qbd.example.com"
+    sync.qbd_to_filevine["conflicts"]["customers"]["1"] = {
+        "filevine": contact_fingerprint({**sync.customer_payload(ann), "email": "ann@filevine.example.com"})
+    }
+
+    sync.sync_customers([ann])
+    assert filevine.writes == []
+    assert "1" in sync.qbd_to_filevine["conflicts"]["customers"]
+
+    # Once QBD is edited to match Filevine the conflict clears without a write
+    ann.email = "ann@filevine.example.com"
+    sync.sync_customers([ann])
+    assert filevine.writes == []
+    assert sync.qbd_to_filevine["conflicts"]["customers"] == {}
+
+
+# Filevine contacts changed since the watermark, and a Conductor that
+# applies the written-back fields the way QBD does
+@pytest.fixture
+def reverse(monkeypatch, filevine):
+    changed = []
+    monkeypatch.setattr(sync, "fetch_changed_filevine_contacts", lambda since, headers: changed)
+
+    async def update_qbd_customers(updates):
+        results = []
+        for qbd_customer, contact in updates:
+            fields = sync.qbd_update_fields(qbd_customer, contact)
+            updated = SimpleNamespace(**{**vars(qbd_customer), **fields})
+            if "name" in fields:
+                updated.full_name = fields["name"]
+            results.append((qbd_customer, contact, updated))
+        return results
+
+    monkeypatch.setattr(sync, "update_qbd_customers", update_qbd_customers)
+    return changed
+
+
+def contact(qbd_id, full_name, email, updated_at="2026-01-02T00:00:00"):
+    return {"personId": f"p-{qbd_id}", "fullName": full_name, "email": email,
+            "personTypes": ["Client"], "updated_at": updated_at}
+
+
+def test_filevine_edit_is_written_back_to_qbd(reverse):
+    ann = customer("1", "Ann", "ann@example.com")
+    synced("1", sync.customer_payload(ann))
+    reverse.append(contact("1", "Ann", "ann@filevine.example.com"))
+    customers = [ann]
+
+    sync.sync_contacts_from_filevine(customers)
+
+    assert customers[0].email == "ann@filevine.example.com"
+    stored = sync.qbd_to_filevine["fingerprints"]["customers"]["1"]
+    assert stored["qbd"] == stored["filevine"] == contact_fingerprint(reverse[0])
+    assert sync.qbd_to_filevine["conflicts"]["customers"] == {}
+    assert sync.qbd_to_filevine["watermarks"]["contacts"] == "2026-01-02T00:00:00"
+
+
+def test_edits_on_both_sides_are_a_conflict(reverse):
+    ann = customer("1", "Ann", "ann@example.com")
+    synced("1", sync.customer_payload(ann))
+    ann.email = "ann@qbd.example.com"
+    reverse.append(contact("1", "Ann", "ann@filevine.example.com"))
+    customers = [ann]
+
+    sync.sync_contacts_from_filevine(customers)
+
+    assert customers[0].email == "ann@qbd.example.com"
+    conflict = sync.qbd_to_filevine["conflicts"]["customers"]["1"]
+    assert conflict["filevine"] == contact_fingerprint(reverse[0])
+
+
+def test_partial_write_back_is_a_conflict(reverse):
+    ann = customer("1", "Ann", "ann@example.com")
+    synced("1", sync.customer_payload(ann))
+    # A cleared email cannot be written back to QBD; the name change can
+    reverse.append(contact("1", "Ann Smith", None))
+    customers = [ann]
+
+    sync.sync_contacts_from_filevine(customers)
+
+    assert customers[0].full_name == "Ann Smith" and customers[0].email == "ann@example.com"
+    stored = sync.qbd_to_filevine["fingerprints"]["customers"]["1"]
+    assert stored["qbd"] == contact_fingerprint(sync.customer_payload(customers[0]))
+    assert sync.qbd_to_filevine["conflicts"]["customers"]["1"]["filevine"] == contact_fingerprint(reverse[0])